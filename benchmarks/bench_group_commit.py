@@ -0,0 +1,89 @@
+"""
+Compare image-insert throughput and latency with and without group commit,
+for each number of database shards.
+
+    python benchmarks/bench_group_commit.py --threads 16 --writes 200 --shards 1,4
+
+Each thread calls database.add_image() in a loop for its own user against a
+fresh temporary database; results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+from database import database
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(group_commit, threads, writes, shards=1):
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.DB_SHARDS = shards
+        database.GROUP_COMMIT = group_commit
+        database._writers = {}
+        database.init_db()
+        for t in range(threads):
+            database.get_or_create_user(f"user{t}")
+
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(t):
+            barrier.wait()
+            local = []
+            for i in range(writes):
+                start = time.perf_counter()
+                database.add_image(f"user{t}", f"https://bucket/user{t}/bench/{i}.png")
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writers = list(database._writers.values())
+        batches = sum(w.batches_committed for w in writers) if writers else len(latencies)
+        for writer in writers:
+            writer.close()
+        database._writers = {}
+
+    return {
+        "group_commit": group_commit,
+        "shards": shards,
+        "writes": len(latencies),
+        "transactions": batches,
+        "throughput_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="inserts per thread")
+    parser.add_argument("--shards", default="1", help="comma-separated shard counts to compare")
+    args = parser.parse_args()
+    results = [run(group_commit, args.threads, args.writes, int(shards))
+               for shards in args.shards.split(",") for group_commit in (False, True)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
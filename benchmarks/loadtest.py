@@ -0,0 +1,267 @@
+"""
+End-to-end load generator. Starts the real app:app under gunicorn with a moto
+server standing in for S3 and a temporary SQLite database, replays a weighted
+traffic mix at each concurrency level for each worker count, and prints
+per-route throughput and p50/p95/p99 latency as JSON.
+
+    python benchmarks/loadtest.py --workers 1,2,4 --concurrency 1,8,32 \\
+        --duration 10 --mix auth=1,upload=2,list=6,delete=1,categories=1 \\
+        --output results.json
+
+Rate limiting is disabled in the app under test unless --keep-limits is given.
+A run in which any request fails with a 5xx or a connection error exits
+non-zero without saving its report unless --allow-errors is given.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from moto.server import ThreadedMotoServer
+from PIL import Image
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+ROUTES = ("auth", "upload", "list", "delete", "categories")
+BUCKET = "loadtest-bucket"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}', expected one of {ROUTES}")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def parse_ints(text):
+    return [int(value) for value in text.split(",")]
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_payload(kb):
+    """A PNG padded with random noise so uploads are roughly kb kilobytes"""
+    side = max(8, int((kb * 1024 / 3) ** 0.5))
+    img = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def start_app(workers, s3_endpoint, db_path, keep_limits, tmp):
+    port = free_port()
+    env = dict(
+        os.environ,
+        BUCKET_NAME=BUCKET,
+        S3_ENDPOINT_URL=s3_endpoint,
+        DATABASE_PATH=db_path,
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        ADMISSION_DB=os.path.join(tmp, f"admission-{port}.db"),
+        IMAGE_CACHE_DIR=os.path.join(tmp, "cache"),
+    )
+    if not keep_limits:
+        env["ADMISSION_CONTROL"] = "off"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+         "--workers", str(workers), "--log-level", "warning",
+         # Run safe_init() once in the master so workers do not race to create the DB
+         "--preload", "app:app"],
+        cwd=SRC_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 30s")
+
+
+class Client:
+    """One simulated user driving the traffic mix with its own session"""
+
+    def __init__(self, base_url, username, payload):
+        self.base_url = base_url
+        self.username = username
+        self.payload = payload
+        self.session = requests.Session()
+        self.uploaded = []
+        self.counter = 0
+
+    def auth(self):
+        return self.session.get(f"{self.base_url}/auth",
+                                params={"username": self.username, "password": "loadtest"})
+
+    def upload(self):
+        self.counter += 1
+        name = f"img{self.counter}.png"
+        response = self.session.post(
+            f"{self.base_url}/api/upload",
+            data={"username": self.username, "category": "load"},
+            files={"file": (name, self.payload, "image/png")},
+        )
+        if response.ok:
+            self.uploaded.append(name)
+        return response
+
+    def list(self):
+        return self.session.get(f"{self.base_url}/api/images", params={"username": self.username})
+
+    def delete(self):
+        if not self.uploaded:
+            return None
+        name = self.uploaded.pop(random.randrange(len(self.uploaded)))
+        return self.session.delete(f"{self.base_url}/api/images/delete",
+                                   json={"username": self.username, "category": "load", "image_name": name})
+
+    def categories(self):
+        if random.random() < 0.5:
+            return self.session.get(f"{self.base_url}/api/categories", params={"username": self.username})
+        self.counter += 1
+        return self.session.post(f"{self.base_url}/api/categories",
+                                 json={"username": self.username, "category_name": f"cat{self.counter}"})
+
+
+def run_level(base_url, mix, concurrency, duration, payload, run_id):
+    routes, weights = zip(*mix.items())
+    samples = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    lock = threading.Lock()
+    clients = [Client(base_url, f"load{run_id}-{i}", payload) for i in range(concurrency)]
+    for client in clients:
+        client.auth()
+    started_at = []
+    finished_at = []
+    barrier = threading.Barrier(concurrency, action=lambda: started_at.append(time.monotonic()))
+
+    def worker(client):
+        barrier.wait()
+        stop_at = started_at[0] + duration
+        local = []
+        while time.monotonic() < stop_at:
+            route = random.choices(routes, weights)[0]
+            start = time.perf_counter()
+            response = getattr(client, route)()
+            if response is None:
+                continue
+            # 400 from creating a duplicate category is an expected outcome, not a failure
+            local.append((route, time.perf_counter() - start, response.status_code < 500))
+        with lock:
+            finished_at.append(time.monotonic())
+            for route, latency, ok in local:
+                samples[route].append(latency)
+                if not ok:
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Requests still running at the stop time are counted, so rates use the time until the last one finished
+    elapsed = max(finished_at) - started_at[0]
+    report = {}
+    for route in routes:
+        latencies = sorted(samples[route])
+        if not latencies:
+            continue
+        report[route] = {
+            "requests": len(latencies),
+            "errors": errors[route],
+            "throughput_per_s": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+    total = sum(r["requests"] for r in report.values())
+    return {"elapsed_s": round(elapsed, 2), "total_throughput_per_s": round(total / elapsed, 1), "routes": report}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=parse_ints, default=[1, 2, 4], help="gunicorn worker counts to sweep")
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 4, 16], help="concurrent clients per step")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency step")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("auth=1,upload=2,list=6,delete=1,categories=1"))
+    parser.add_argument("--payload-kb", type=int, default=64, help="approximate upload size")
+    parser.add_argument("--keep-limits", action="store_true", help="leave per-user rate limiting on")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--allow-errors", action="store_true",
+                        help="save the report even if some requests failed with 5xx or a connection error")
+    args = parser.parse_args()
+
+    payload = make_payload(args.payload_kb)
+    moto_port = free_port()
+    moto = ThreadedMotoServer(port=moto_port, verbose=False)
+    moto.start()
+    s3_endpoint = f"http://127.0.0.1:{moto_port}"
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for workers in args.workers:
+                db_path = os.path.join(tmp, f"loadtest-{workers}.db")
+                process, base_url = start_app(workers, s3_endpoint, db_path, args.keep_limits, tmp)
+                try:
+                    for concurrency in args.concurrency:
+                        print(f"workers={workers} concurrency={concurrency}", file=sys.stderr)
+                        level = run_level(base_url, args.mix, concurrency, args.duration, payload,
+                                          f"{workers}-{concurrency}")
+                        results.append({"workers": workers, "concurrency": concurrency, **level})
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        moto.stop()
+
+    failed = sorted({f"workers={level['workers']} concurrency={level['concurrency']} {route}"
+                     for level in results for route, stats in level["routes"].items() if stats["errors"]})
+    report = json.dumps({
+        "commit": git_commit(),
+        "config": {"duration_s": args.duration, "mix": args.mix, "payload_kb": args.payload_kb,
+                   "rate_limits": args.keep_limits},
+        "failed": failed,
+        "results": results,
+    }, indent=2)
+    if failed and not args.allow_errors:
+        # A run with server errors measures a broken app, not capacity; never save it as a baseline
+        print(report, file=sys.stderr)
+        sys.exit(f"requests failed in: {', '.join(failed)} (rerun with --allow-errors to save anyway)")
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
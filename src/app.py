@@ -1,34 +1,199 @@
 import os
-from flask import Flask, render_template, request, abort, jsonify
+import json
+import hashlib
+import hmac
+import tempfile
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, abort, jsonify, stream_with_context, send_file, g
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from database import database
 from database import storageAws
+from database import imageProcessing
+from database.storageDiskCache import DiskCache
+from web import admission
+from web import resilience
+from database import categoryMoves
+from web import staticAssets
+from web import profiler
+from database import imageCollector
+from database import keyLayout
+from database import imageArchive
 
 load_dotenv()
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+staticAssets.init_app(app)
 BUCKET_NAME = os.getenv('BUCKET_NAME')
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'image-hosting-cache'))
+IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '512'))
+MAX_VARIANT_SIZE = 4096
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 1000
+image_cache = DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'on').lower() not in ('0', 'off', 'false')
+admission_control = admission.AdmissionController(
+    os.getenv('ADMISSION_DB', os.path.join(tempfile.gettempdir(), 'image-hosting-admission.db')),
+    admission.limits_from_env(),
+    max_inflight=int(os.getenv('MAX_INFLIGHT_REQUESTS', '64')),
+)
+# Endpoints subject to per-user limits, mapped to their limit class
+ADMISSION_ROUTES = {
+    'upload_file': 'upload',
+    'get_images': 'list',
+    'export_images': 'list',
+    'archive_images': 'list',
+    'get_categories': 'list',
+    'get_changes': 'list',
+}
+
+def bucket_names():
+    """Buckets images are spread over (see keyLayout), primary first"""
+    return keyLayout.buckets(BUCKET_NAME)
+
+
+def image_urls(username, category, name):
+    """URLs an image may be stored under: the current key layout, then the one it may predate"""
+    return [storageAws.object_url(bucket, key)
+            for bucket, key in keyLayout.candidates(bucket_names(), username, category, name, BUCKET_NAME)]
+
 
 def safe_init():
     """Initialize database and S3 bucket only if they don't exist"""
 
-    if not os.path.exists(database.DB_NAME):
-        print(f"Database not found. Initializing at {database.DB_NAME}")
+    if not os.path.exists(database.shard_path(0)):
+        print(f"Database not found. Initializing at {database.shard_path(0)}")
         database.init_db()
     else:
-        print(f"Database already exists at {database.DB_NAME}")
+        print(f"Database already exists at {database.shard_path(0)}")
+        database.migrate_db()
 
     if not BUCKET_NAME:
         print("BUCKET_NAME not set. Skipping S3 initialization.")
         return
-    print(f"Ensuring bucket {BUCKET_NAME} exists...")
-    if storageAws.create_bucket(BUCKET_NAME):
-        storageAws.make_bucket_public(BUCKET_NAME)
-        print(f"Bucket {BUCKET_NAME} is ready")
+    for bucket in bucket_names():
+        print(f"Ensuring bucket {bucket} exists...")
+        if storageAws.create_bucket(bucket):
+            storageAws.make_bucket_public(bucket)
+            print(f"Bucket {bucket} is ready")
 safe_init()
 
+@app.before_request
+def start_image_collector():
+    imageCollector.ensure_started(bool(BUCKET_NAME))
+
+
+@app.before_request
+def start_profiling():
+    token = request.headers.get('X-Profile') or request.args.get('_profile')
+    trigger = profiler.trigger_for(token)
+    if trigger:
+        g.profile_capture = profiler.Capture(trigger)
+
+
+@app.after_request
+def record_profiled_status(response):
+    if 'profile_capture' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_profiling(exc):
+    capture = g.pop('profile_capture', None)
+    if capture is None:
+        return
+    body = request.get_json(silent=True) if request.is_json else None
+    username = (request.args.get('username') or request.form.get('username')
+                or (body or {}).get('username'))
+    capture.finish({
+        'route': request.url_rule.rule if request.url_rule else request.path,
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'user': username,
+        'status': g.pop('profile_status', 500),
+    })
+
+
+@app.before_request
+def admit_request():
+    route_class = ADMISSION_ROUTES.get(request.endpoint)
+    if not ADMISSION_CONTROL or route_class is None:
+        return None
+    # Never request.form here: for an upload that would read and parse the whole body before it could be shed
+    username = (request.args.get('username') or request.headers.get('X-Username')
+                or f"addr:{request.remote_addr}")
+    decision = admission_control.admit(route_class, username)
+    if not decision.allowed:
+        message = 'Server busy' if decision.status == 503 else 'Too many requests'
+        response = jsonify({'error': message, 'reason': decision.reason})
+        response.status_code = decision.status
+        response.headers['Retry-After'] = str(decision.retry_after)
+        return response
+    g.admission_slots = decision.slots
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    slots = g.pop('admission_slots', None)
+    if slots:
+        admission_control.release(slots)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'admission': admission_control.get_counters(),
+        's3': {'circuit': resilience.breaker.state},
+    })
+
+
+def require_admin():
+    """Admin routes are hidden unless ADMIN_TOKEN is set and presented as a bearer token"""
+    header = request.headers.get('Authorization', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(header, f"Bearer {ADMIN_TOKEN}"):
+        abort(404)
+
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    require_admin()
+    return jsonify(database.get_stats())
+
+
+@app.route('/admin/gc', methods=['POST'])
+def run_image_gc():
+    """Collect expired deleted images now instead of waiting for the background pass"""
+    require_admin()
+    return jsonify(imageCollector.collect())
+
+
+@app.route('/admin/changes/compact', methods=['POST'])
+def compact_changes():
+    """Compact the change log now instead of waiting for the background pass"""
+    require_admin()
+    return jsonify({'removed': imageCollector.compact()})
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    require_admin()
+    return jsonify(profiler.list_captures())
+
+
+@app.route('/admin/profiles/<capture_id>', methods=['GET'])
+def download_profile(capture_id):
+    require_admin()
+    path = profiler.capture_file(capture_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain' if path.endswith('.collapsed') else 'application/octet-stream',
+                     as_attachment=True)
+
+
 @app.route('/auth')
 def auth():
     username = request.args.get('username', '').strip()
@@ -70,12 +235,16 @@ def upload_file():
     category = request.form.get('category', 'uncategorized')
     if file.filename == '' or not username:
         return jsonify({'error': 'No selected file or username missing'}), 400
+    # Admission control limited this upload as that user; it must be the one it is stored under
+    limited_as = request.args.get('username') or request.headers.get('X-Username')
+    if limited_as and limited_as != username:
+        return jsonify({'error': 'X-Username does not match username'}), 400
     filename = secure_filename(file.filename)
-    s3_key = f"{username}/{category}/{filename}"
-    success = storageAws.upload_image_direct(BUCKET_NAME, file, s3_key)
-    if success:
-        s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
-        database.add_image(username, s3_url)
+    bucket, s3_key = keyLayout.locate(bucket_names(), username, category, filename)
+    metadata = storageAws.upload_image_with_metadata(bucket, file.stream, s3_key, file.mimetype or None)
+    if metadata:
+        s3_url = storageAws.object_url(bucket, s3_key)
+        database.add_image(username, s3_url, {**metadata, 'bucket': bucket, 's3_key': s3_key})
         return jsonify({'message': 'Upload successful', 'url': s3_url}), 200
     else:
         return jsonify({'error': 'Failed to upload to S3'}), 500
@@ -85,14 +254,94 @@ def upload_file():
 def get_images():
     username = request.args.get('username')
     category = request.args.get('category')
+    details = request.args.get('details', '').lower() in ('1', 'true')
     if not username:
         return jsonify([]), 200
+    if details:
+        # Stored metadata lets clients size their layout without touching S3
+        images = database.get_image_details_by_username(username)
+        if category:
+            images = [img for img in images if f"/{category}/" in img['url']]
+        return jsonify(images)
     images = database.get_images_by_username(username)
     if category:
         images = [img for img in images if f"/{category}/" in img]
     return jsonify(images)
 
 
+def parse_timestamp(value):
+    """
+    Normalize an ISO date/datetime to the format SQLite stores created_at in
+    (UTC); raises ValueError if it is not one
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+@app.route('/api/images/export', methods=['GET'])
+def export_images():
+    username = request.args.get('username')
+    category = request.args.get('category')
+    if not username:
+        return jsonify({'error': 'Username required'}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        until = parse_timestamp(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 dates'}), 400
+
+    def generate():
+        for image in database.iter_image_details(username, category, since, until):
+            yield json.dumps(image) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/images/archive', methods=['GET'])
+def archive_images():
+    username = request.args.get('username')
+    category = request.args.get('category')
+    if not username:
+        return jsonify({'error': 'Username required'}), 400
+
+    # Read the whole listing before streaming so no database read is open
+    # while the client downloads
+    entries = []
+    rows = database.iter_image_details(username, category,
+                                       fields='i.bucket, i.s3_key, i.size_bytes, i.created_at')
+    for row in rows:
+        parts = keyLayout.parse(row['s3_key'])
+        if parts is None:
+            continue
+        entries.append({
+            'name': parts[2] if category else f"{parts[1]}/{parts[2]}",
+            'bucket': row['bucket'],
+            'key': row['s3_key'],
+            'size': row['size_bytes'],
+            'created_at': row['created_at'],
+        })
+
+    filename = secure_filename(f"{username}-{category}.zip" if category else f"{username}.zip")
+    return Response(stream_with_context(imageArchive.stream_archive(entries)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    username = request.args.get('username')
+    since = request.args.get('since', '0')
+    limit = request.args.get('limit', str(CHANGES_PAGE_SIZE))
+    if not username:
+        return jsonify({'error': 'Username required'}), 400
+    if not since.isdigit() or not limit.isdigit() or int(limit) < 1:
+        return jsonify({'error': 'since must be a sequence number and limit a positive integer'}), 400
+    return jsonify(database.get_changes(username, int(since), min(int(limit), CHANGES_MAX_PAGE_SIZE)))
+
+
 @app.route('/api/images/delete', methods=['DELETE'])
 def delete_image():
     username = request.json.get('username')
@@ -100,14 +349,29 @@ def delete_image():
     image_name = request.json.get('image_name')
     if not username or not category or not image_name:
         return jsonify({'error': 'Username, category, and image_name required'}), 400
-    s3_key = f"{username}/{category}/{image_name}"
-    image_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
-    s3_deleted = storageAws.delete_image(BUCKET_NAME, s3_key)
-    db_deleted = database.delete_image_by_username(username, image_url)
-    if s3_deleted and db_deleted:
+    # The S3 object is removed by imageCollector once the restore window has passed
+    urls = image_urls(username, category, image_name)
+    if any(database.tombstone_image_by_username(username, url) for url in urls):
         return jsonify({'message': 'Image deleted successfully'}), 200
-    else:
-        return jsonify({'error': 'Failed to delete image'}), 500
+    return jsonify({'error': 'Image not found'}), 404
+
+
+@app.route('/api/images/restore', methods=['POST'])
+def restore_image():
+    username = request.json.get('username')
+    category = request.json.get('category')
+    image_name = request.json.get('image_name')
+    if not username or not category or not image_name:
+        return jsonify({'error': 'Username, category, and image_name required'}), 400
+    for image_url in image_urls(username, category, image_name):
+        result = database.restore_image_by_username(username, image_url, imageCollector.RETENTION_SECONDS)
+        if result != 'not_found':
+            break
+    if result == 'restored':
+        return jsonify({'message': 'Image restored', 'url': image_url}), 200
+    if result == 'conflict':
+        return jsonify({'error': 'An image with this name has been uploaded since'}), 409
+    return jsonify({'error': 'No deleted image to restore'}), 404
 
 
 @app.route('/api/categories', methods=['GET'])
@@ -130,6 +394,75 @@ def create_category():
     return jsonify(result), status_code
 
 
+def move_category_response(username, source, target, merge):
+    if not username or not source or not target:
+        return jsonify({'error': 'Username, category_name and target category required'}), 400
+    result = categoryMoves.move_category(bucket_names(), username, source, target, merge,
+                                         legacy_bucket=BUCKET_NAME)
+    if result['success']:
+        return jsonify(result), 200
+    # Retryable failures left a resumable move behind; calling again continues it
+    return jsonify(result), 500 if result['retryable'] else 400
+
+
+@app.route('/api/categories/rename', methods=['POST'])
+def rename_category():
+    return move_category_response(request.json.get('username'), request.json.get('category_name'),
+                                  request.json.get('new_name'), merge=False)
+
+
+@app.route('/api/categories/merge', methods=['POST'])
+def merge_category():
+    return move_category_response(request.json.get('username'), request.json.get('category_name'),
+                                  request.json.get('target'), merge=True)
+
+
+@app.route('/img/<username>/<category>/<name>', methods=['GET'])
+def resized_image(username, category, name):
+    width = request.args.get('w', type=int)
+    height = request.args.get('h', type=int)
+    quality = request.args.get('q', 80, type=int)
+    if any(v is not None and not 1 <= v <= MAX_VARIANT_SIZE for v in (width, height)):
+        return jsonify({'error': f'w and h must be between 1 and {MAX_VARIANT_SIZE}'}), 400
+    if not 1 <= quality <= 100:
+        return jsonify({'error': 'q must be between 1 and 100'}), 400
+
+    image = next(filter(None, (database.get_image_details(username, url)
+                               for url in image_urls(username, category, name))), None)
+    if image is None:
+        return jsonify({'error': 'Image not found'}), 404
+
+    accepted = [mimetype for mimetype, q in request.accept_mimetypes if q > 0]
+    fmt = imageProcessing.negotiate_format(accepted, image['content_type'])
+    # The source ETag is part of the key, so re-uploading an image invalidates its variants
+    variant = f"{image['s3_key']}|{image['etag']}|{width}|{height}|{quality}|{fmt}"
+    etag = hashlib.sha256(variant.encode()).hexdigest()[:32]
+
+    def produce():
+        original = storageAws.get_image(image['bucket'], image['s3_key'])
+        if original is None:
+            return None
+        return imageProcessing.render_variant(original, width, height, quality, fmt)
+
+    def send_variant():
+        path = image_cache.get_or_create(variant, produce)
+        if path is None:
+            return jsonify({'error': 'Failed to fetch image from S3'}), 502
+        response = send_file(path, mimetype=imageProcessing.MIME_TYPES[fmt], etag=etag,
+                             conditional=True, max_age=86400)
+        response.vary.add('Accept')
+        return response
+
+    try:
+        try:
+            return send_variant()
+        except FileNotFoundError:
+            # Another worker evicted the variant between the lookup and the open; build it again
+            return send_variant()
+    except imageProcessing.UnsupportedImage:
+        return jsonify({'error': 'The stored file is not a decodable image'}), 422
+
+
 @app.route('/gallery', methods=['GET'])
 def image_grid():
     return render_template('images/grid.html')
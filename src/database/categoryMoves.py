@@ -0,0 +1,92 @@
+"""
+Category rename and merge. Categories are part of every object key (see
+keyLayout), so a move is:
+
+1. parallel server-side copies to the new keys ('copying'),
+2. one DB transaction rewriting image URLs and category rows ('deleting'),
+3. batched deletes of the old keys ('done').
+
+Progress is recorded in category_moves, so calling move_category again after
+an interruption resumes from the phase it stopped in.
+"""
+import os
+from . import database
+from . import keyLayout
+from . import storageAws
+
+MOVE_CONCURRENCY = int(os.getenv('CATEGORY_MOVE_CONCURRENCY', '16'))
+
+
+def _images_in_category(username, category_name):
+    """[(image_id, filename, bucket, key, size_bytes)] for images stored under username/category"""
+    images = []
+    for row in database.get_category_image_rows(username, category_name):
+        parts = keyLayout.parse(row['s3_key'])
+        if parts and parts[0] == username and parts[1] == category_name:
+            images.append((row['id'], parts[2], row['bucket'], row['s3_key'], row['size_bytes']))
+    return images
+
+
+def _failure(message, retryable=False, **extra):
+    return {'success': False, 'message': message, 'retryable': retryable, **extra}
+
+
+def move_category(bucket_names, username, source, target, merge=False, legacy_bucket=None):
+    if source == target:
+        return _failure('Source and target categories are the same')
+    if not database.get_user_id(username):
+        return _failure('Category not found')
+
+    move = database.get_pending_category_move(username, source)
+    resuming = move is not None
+    if move and (move['target'] != target or bool(move['merge']) != merge):
+        return _failure(f"A move of this category to '{move['target']}' is still in progress")
+    if move is None:
+        source_images = _images_in_category(username, source)
+        if not source_images and not database.category_exists(username, source):
+            return _failure('Category not found')
+        target_images = _images_in_category(username, target)
+        if not merge and (target_images or database.category_exists(username, target)):
+            return _failure('Category already exists')
+        conflicts = sorted({image[1] for image in source_images} & {image[1] for image in target_images})
+        if conflicts:
+            return _failure('Images with the same name exist in both categories', conflicts=conflicts)
+        move = database.create_category_move(username, source, target, merge)
+
+    moved = 0
+    if move['status'] == 'copying':
+        source_images = _images_in_category(username, source)
+        destinations = {image_id: keyLayout.locate(bucket_names, username, target, name)
+                        for image_id, name, _, _, _ in source_images}
+        existing = {}
+        if resuming:
+            # Skip objects a previous, interrupted attempt already copied
+            existing = storageAws.object_sizes(list(destinations.values()), MOVE_CONCURRENCY)
+            if existing is None:
+                return _failure('Failed to check copied images; retry to resume', retryable=True)
+        copies = []
+        for image_id, _, bucket, key, size in source_images:
+            dest = destinations[image_id]
+            if dest in existing and (size is None or existing[dest] == size):
+                continue
+            copies.append((bucket, key, *dest, size))
+        failed = storageAws.copy_images(copies, MOVE_CONCURRENCY)
+        if failed:
+            return _failure(f'Failed to copy {len(failed)} images; retry to resume', retryable=True)
+        url_updates = [(image_id, bucket, key, storageAws.object_url(bucket, key))
+                       for image_id, (bucket, key) in destinations.items()]
+        database.apply_category_move(username, move, url_updates)
+        moved = len(url_updates)
+
+    # Where the moved images used to live; any that a row still references
+    # (uploaded mid-move, or deleted but restorable) are kept
+    old_locations = [location for _, name, _, _, _ in _images_in_category(username, target)
+                     for location in keyLayout.candidates(bucket_names, username, source, name, legacy_bucket)]
+    referenced = database.get_referenced_locations(old_locations)
+    stale = [location for location in set(old_locations) if location not in referenced]
+    failed = storageAws.delete_locations(stale)
+    if failed:
+        return _failure(f'Images moved; failed to delete {len(failed)} originals, retry to finish',
+                        retryable=True)
+    database.finish_category_move(username, move['id'])
+    return {'success': True, 'message': 'Category merged' if merge else 'Category renamed', 'moved': moved}
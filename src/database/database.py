@@ -1,21 +1,108 @@
+import hashlib
 import sqlite3
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .groupCommit import GroupCommitWriter
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_NAME = os.path.join(BASE_DIR, "database.db")
+DB_NAME = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, "database.db"))
+# Users are spread over this many SQLite files by a hash of the username so
+# writes from different users do not contend for one database lock
+DB_SHARDS = int(os.getenv('DATABASE_SHARDS', '1'))
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Optional group commit for image inserts/deletes (see groupCommit.py)
+GROUP_COMMIT = os.getenv('GROUP_COMMIT', '').lower() in ('1', 'true')
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv('GROUP_COMMIT_MAX_DELAY_MS', '5'))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '64'))
+_writers = {}
+_writer_lock = threading.Lock()
+
+# Change-log entries older than this are compacted away; clients further behind re-list
+CHANGE_LOG_RETENTION_SECONDS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', '30')) * 86400
+# Compaction deletes at most this many entries per transaction so writers are not held up
+CHANGE_LOG_COMPACT_BATCH = 1000
+
+# Bounded LRU of username -> id so write paths skip the user lookup
+USER_ID_CACHE_SIZE = int(os.getenv('USER_ID_CACHE_SIZE', '10000'))
+_user_ids = OrderedDict()
+_user_ids_lock = threading.Lock()
+
+
+def shard_path(shard, shards=None):
+    """File of one shard; a single shard is DB_NAME itself, so unsharded deployments are unchanged"""
+    shards = shards or DB_SHARDS
+    if shards == 1:
+        return DB_NAME
+    root, ext = os.path.splitext(DB_NAME)
+    # The shard count is part of the name so a reshard never overwrites the files it reads
+    return f"{root}.{shard}-of-{shards}{ext}"
+
+
+def shard_for(username, shards=None):
+    """Stable shard index for a username"""
+    shards = shards or DB_SHARDS
+    if shards == 1:
+        return 0
+    return int(hashlib.sha256(username.encode()).hexdigest()[:8], 16) % shards
+
+
+def get_db_connection(shard=0):
+    conn = sqlite3.connect(shard_path(shard))
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def for_each_shard(operation, *args):
+    """Run operation(shard, *args) on every shard in parallel; returns the results in shard order"""
+    if DB_SHARDS == 1:
+        return [operation(0, *args)]
+    with ThreadPoolExecutor(max_workers=DB_SHARDS) as pool:
+        return list(pool.map(lambda shard: operation(shard, *args), range(DB_SHARDS)))
+
+
+def get_writer(shard=0):
+    """Create a shard's group-commit writer lazily so each gunicorn worker gets its own after fork"""
+    with _writer_lock:
+        if shard not in _writers:
+            _writers[shard] = GroupCommitWriter(
+                lambda: get_db_connection(shard),
+                max_delay=GROUP_COMMIT_MAX_DELAY_MS / 1000,
+                max_batch=GROUP_COMMIT_MAX_BATCH,
+            )
+        return _writers[shard]
+
+
+def run_write(shard, operation, *args):
+    """Run operation(conn, *args) on a shard in its own transaction, or batched when GROUP_COMMIT is on"""
+    if GROUP_COMMIT:
+        return get_writer(shard).submit(operation, *args).result()
+    conn = get_db_connection(shard)
+    try:
+        result = operation(conn, *args)
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Create empty tables in every shard, dropping existing ones"""
+    for shard in range(DB_SHARDS):
+        conn = get_db_connection(shard)
+        create_schema(conn)
+        conn.close()
+    clear_user_id_cache()
 
+
+def create_schema(conn):
+    cursor = conn.cursor()
     cursor.executescript('''
          DROP TABLE IF EXISTS images;
          DROP TABLE IF EXISTS categories;
+         DROP TABLE IF EXISTS category_moves;
+         DROP TABLE IF EXISTS changes;
+         DROP TABLE IF EXISTS change_log_state;
          DROP TABLE IF EXISTS users;
 
          CREATE TABLE users
@@ -31,6 +118,15 @@ def init_db():
              id         INTEGER PRIMARY KEY AUTOINCREMENT,
              user_id    INTEGER NOT NULL,
              image_url  TEXT    NOT NULL,
+             size_bytes   INTEGER,
+             content_type TEXT,
+             etag         TEXT,
+             width        INTEGER,
+             height       INTEGER,
+             placeholder  TEXT,
+             bucket       TEXT,
+             s3_key       TEXT,
+             deleted_at   TIMESTAMP,
              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
              FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
          );
@@ -45,74 +141,357 @@ def init_db():
              UNIQUE (user_id, name)
          );
                          ''')
+    cursor.executescript(ADDED_TABLES)
+    conn.commit()
+
+
+# Columns added after the original schema, applied to existing databases by migrate_db()
+IMAGE_COLUMNS = {
+    'size_bytes': 'INTEGER',
+    'content_type': 'TEXT',
+    'etag': 'TEXT',
+    'width': 'INTEGER',
+    'height': 'INTEGER',
+    'placeholder': 'TEXT',
+    'bucket': 'TEXT',
+    's3_key': 'TEXT',
+}
+# Set when an image is deleted; the row is purged by imageCollector after the retention window
+TOMBSTONE_COLUMNS = {
+    'deleted_at': 'TIMESTAMP',
+}
+
+
+# Tables and indexes added after the original schema; safe to run on any database
+ADDED_TABLES = '''
+         CREATE INDEX IF NOT EXISTS idx_images_user_created ON images (user_id, created_at);
+         CREATE INDEX IF NOT EXISTS idx_images_url ON images (image_url);
+         CREATE INDEX IF NOT EXISTS idx_images_key ON images (s3_key);
+         CREATE INDEX IF NOT EXISTS idx_images_deleted ON images (deleted_at) WHERE deleted_at IS NOT NULL;
+
+         CREATE TABLE IF NOT EXISTS category_moves
+         (
+             id         INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id    INTEGER NOT NULL,
+             source     TEXT    NOT NULL,
+             target     TEXT    NOT NULL,
+             merge      INTEGER NOT NULL DEFAULT 0,
+             status     TEXT    NOT NULL DEFAULT 'copying',
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+         );
+
+         -- One row per image/category insert or delete, written in the same
+         -- transaction as the change; seq orders them for delta sync
+         CREATE TABLE IF NOT EXISTS changes
+         (
+             seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id    INTEGER NOT NULL,
+             kind       TEXT    NOT NULL,
+             op         TEXT    NOT NULL,
+             item       TEXT    NOT NULL,
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+         );
+         CREATE INDEX IF NOT EXISTS idx_changes_user_seq ON changes (user_id, seq);
+         CREATE INDEX IF NOT EXISTS idx_changes_item ON changes (user_id, kind, item, seq);
+
+         -- compacted_through: highest seq that may have been dropped by compaction
+         CREATE TABLE IF NOT EXISTS change_log_state
+         (
+             key   TEXT PRIMARY KEY,
+             value INTEGER NOT NULL
+         );
+'''
+
+
+IMAGE_DETAIL_FIELDS = '''i.image_url AS url, i.size_bytes, i.content_type, i.etag,
+                   i.width, i.height, i.placeholder, i.created_at'''
+
+
+def migrate_db():
+    for_each_shard(_migrate_shard)
+
+
+def _migrate_shard(shard):
+    conn = get_db_connection(shard)
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(images)")}
+    for column, column_type in {**IMAGE_COLUMNS, **TOMBSTONE_COLUMNS}.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE images ADD COLUMN {column} {column_type}")
+    # Rows from before bucket/s3_key were stored: recover them from storageAws.object_url's format
+    conn.execute('''
+        UPDATE images
+        SET bucket = substr(image_url, 9, instr(image_url, '.s3.amazonaws.com/') - 9),
+            s3_key = substr(image_url, instr(image_url, '.s3.amazonaws.com/') + 18)
+        WHERE s3_key IS NULL AND image_url LIKE 'https://%.s3.amazonaws.com/%'
+    ''')
+    conn.executescript(ADDED_TABLES)
+    # A shard from before the change log has history the log never saw: start
+    # the log at 1, marked compacted, so a client syncing from 0 re-lists
+    unlogged = conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'changes'").fetchone() is None
+    if unlogged and conn.execute("SELECT EXISTS (SELECT 1 FROM images) OR EXISTS (SELECT 1 FROM categories)").fetchone()[0]:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('changes', 1)")
+        conn.execute("INSERT OR IGNORE INTO change_log_state (key, value) VALUES ('compacted_through', 1)")
     conn.commit()
     conn.close()
 
 
 def get_user_id(username):
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for(username))
     res = conn.execute("SELECT id FROM users WHERE username = ?", (username,))
     user = res.fetchone()
     conn.close()
     return user['id'] if user else None
 
 
+def _cached_user_id(username):
+    with _user_ids_lock:
+        user_id = _user_ids.get(username)
+        if user_id is not None:
+            _user_ids.move_to_end(username)
+        return user_id
+
+
+def _remember_user_id(username, user_id):
+    if USER_ID_CACHE_SIZE <= 0:
+        return
+    with _user_ids_lock:
+        _user_ids[username] = user_id
+        _user_ids.move_to_end(username)
+        while len(_user_ids) > USER_ID_CACHE_SIZE:
+            _user_ids.popitem(last=False)
+
+
+def _forget_user_id(username):
+    with _user_ids_lock:
+        _user_ids.pop(username, None)
+
+
+def clear_user_id_cache():
+    with _user_ids_lock:
+        _user_ids.clear()
+
+
+def _resolve_user(conn, username, password_hash=""):
+    """
+    Create the user if missing and return its id, in one statement for new
+    users. The id is not cached here: the caller's transaction (or group
+    commit savepoint) may still roll back, and AUTOINCREMENT would then hand
+    the same id to someone else. Callers cache it once run_write returns.
+    """
+    rows = conn.execute(
+        "INSERT INTO users (username, password) VALUES (?, ?) ON CONFLICT (username) DO NOTHING RETURNING id",
+        (username, password_hash)
+    ).fetchall()
+    if not rows:
+        rows = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchall()
+    return rows[0]['id']
+
+
 def create_user(username, password_hash=""):
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for(username))
     cursor = conn.cursor()
     cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
     conn.commit()
     user_id = cursor.lastrowid
     conn.close()
+    _remember_user_id(username, user_id)
     return user_id
 
 
 def get_or_create_user(username):
-    user_id = get_user_id(username)
-    if user_id:
+    user_id = _cached_user_id(username)
+    if user_id is not None:
         return user_id
-    return create_user(username)
+    user_id = run_write(shard_for(username), _resolve_user, username)
+    _remember_user_id(username, user_id)
+    return user_id
 
 
 def get_user(username):
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for(username))
     res = conn.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
     user = res.fetchone()
     conn.close()
     return dict(user) if user else None
 
 
-def add_image(username, image_url):
-    user_id = get_or_create_user(username)
-    conn = get_db_connection()
-    conn.execute("INSERT INTO images (user_id, image_url) VALUES (?, ?)", (user_id, image_url))
-    conn.commit()
+def _record_change(conn, user_id, kind, op, item):
+    """Append to the change log; call inside the transaction making the change"""
+    conn.execute("INSERT INTO changes (user_id, kind, op, item) VALUES (?, ?, ?, ?)", (user_id, kind, op, item))
+
+
+def _record_user_change(conn, username, kind, op, item):
+    conn.execute(
+        "INSERT INTO changes (user_id, kind, op, item) SELECT id, ?, ?, ? FROM users WHERE username = ?",
+        (kind, op, item, username)
+    )
+
+
+def _insert_image(conn, username, image_url, metadata):
+    """
+    Insert an image row for username; returns (image id, user id). A cached
+    user id is only trusted if it still belongs to username (the users table
+    may have been rebuilt since), which is checked in the INSERT itself so
+    the common case is one statement.
+    """
+    columns = ", ".join(IMAGE_COLUMNS)
+    values = (image_url, *(metadata.get(column) for column in IMAGE_COLUMNS))
+    user_id = _cached_user_id(username)
+    if user_id is not None:
+        cursor = conn.execute(
+            f'''INSERT INTO images (user_id, image_url, {columns})
+                SELECT ?, ?, {", ".join("?" for _ in IMAGE_COLUMNS)}
+                WHERE EXISTS (SELECT 1 FROM users WHERE id = ? AND username = ?)''',
+            (user_id, *values, user_id, username)
+        )
+        if cursor.rowcount:
+            image_id = cursor.lastrowid
+            _record_change(conn, user_id, 'image', 'insert', image_url)
+            return image_id, user_id
+        _forget_user_id(username)
+    user_id = _resolve_user(conn, username)
+    cursor = conn.execute(
+        f'''INSERT INTO images (user_id, image_url, {columns})
+            VALUES (?, ?, {", ".join("?" for _ in IMAGE_COLUMNS)})''',
+        (user_id, *values)
+    )
+    image_id = cursor.lastrowid
+    _record_change(conn, user_id, 'image', 'insert', image_url)
+    return image_id, user_id
+
+
+def add_image(username, image_url, metadata=None):
+    image_id, user_id = run_write(shard_for(username), _insert_image, username, image_url, metadata or {})
+    # Only now is the insert (and a user it may have created) committed
+    _remember_user_id(username, user_id)
+    return image_id
+
+
+def _delete_image(conn, user_id, image_url):
+    cursor = conn.execute("DELETE FROM images WHERE user_id = ? AND image_url = ?", (user_id, image_url))
+    if cursor.rowcount:
+        _record_change(conn, user_id, 'image', 'delete', image_url)
+    return cursor.rowcount > 0
+
+
+def delete_image(user_id, image_url, shard=0):
+    """Delete by user id; ids are per shard, so the user's shard must be given when sharded"""
+    return run_write(shard, _delete_image, user_id, image_url)
+
+
+def _delete_image_by_username(conn, username, image_url):
+    cursor = conn.execute(
+        "DELETE FROM images WHERE image_url = ? AND user_id = (SELECT id FROM users WHERE username = ?)",
+        (image_url, username)
+    )
+    if cursor.rowcount:
+        _record_user_change(conn, username, 'image', 'delete', image_url)
+    return cursor.rowcount > 0
+
+
+def delete_image_by_username(username, image_url):
+    return run_write(shard_for(username), _delete_image_by_username, username, image_url)
+
+
+def _tombstone_image(conn, username, image_url):
+    cursor = conn.execute(
+        """UPDATE images SET deleted_at = CURRENT_TIMESTAMP
+           WHERE image_url = ? AND deleted_at IS NULL
+             AND user_id = (SELECT id FROM users WHERE username = ?)""",
+        (image_url, username)
+    )
+    if cursor.rowcount:
+        _record_user_change(conn, username, 'image', 'delete', image_url)
+    return cursor.rowcount > 0
+
+
+def tombstone_image_by_username(username, image_url):
+    """Mark an image deleted; its S3 object and row are removed later by imageCollector"""
+    return run_write(shard_for(username), _tombstone_image, username, image_url)
+
+
+def restore_image_by_username(username, image_url, retention_seconds):
+    """
+    Undo the most recent delete of image_url if it is still within the
+    retention window. Returns 'restored', 'not_found' or 'conflict' (the
+    same URL has been uploaded again since).
+    """
+    conn = get_db_connection(shard_for(username))
+    with conn:
+        user_id = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        user_id = user_id['id'] if user_id else None
+        live = conn.execute("SELECT 1 FROM images WHERE user_id = ? AND image_url = ? AND deleted_at IS NULL",
+                            (user_id, image_url)).fetchone()
+        # Tombstones past the window may already be mid-collection, so only younger ones are restorable
+        tombstone = conn.execute(
+            """SELECT id FROM images
+               WHERE user_id = ? AND image_url = ? AND deleted_at > datetime('now', ?)
+               ORDER BY deleted_at DESC, id DESC LIMIT 1""",
+            (user_id, image_url, f'-{int(retention_seconds)} seconds')
+        ).fetchone()
+        if tombstone and not live:
+            conn.execute("UPDATE images SET deleted_at = NULL WHERE id = ?", (tombstone['id'],))
+            _record_change(conn, user_id, 'image', 'insert', image_url)
     conn.close()
+    if tombstone is None:
+        return 'not_found'
+    return 'conflict' if live else 'restored'
 
 
-def delete_image(user_id, image_url):
-    conn = get_db_connection()
-    conn.execute("DELETE FROM images WHERE user_id = ? AND image_url = ?", (user_id, image_url))
-    conn.commit()
-    rows_affected = conn.total_changes
+def get_expired_tombstones(shard, retention_seconds, limit):
+    """Oldest deleted images in a shard past the retention window, as (id, url, bucket, s3_key, etag)"""
+    conn = get_db_connection(shard)
+    rows = conn.execute(
+        """SELECT id, image_url AS url, bucket, s3_key, etag
+           FROM images
+           WHERE deleted_at IS NOT NULL AND deleted_at <= datetime('now', ?)
+           ORDER BY deleted_at
+           LIMIT ?""",
+        (f'-{int(retention_seconds)} seconds', limit)
+    ).fetchall()
     conn.close()
-    return rows_affected > 0
+    return [dict(row) for row in rows]
 
 
-def delete_image_by_username(username, image_url):
-    user_id = get_user_id(username)
-    if not user_id:
-        return False
-    return delete_image(user_id, image_url)
+def purge_tombstones(shard, tombstones, delete_objects):
+    """
+    Purge tombstoned rows after deleting their objects. delete_objects is
+    called with the tombstones whose object no live row uses and returns the
+    ids whose object could not be deleted; those rows stay for the next pass.
+    It runs with no transaction open, so uploads to the shard never wait on
+    S3; an upload that lands meanwhile is caught by delete_objects' ETag
+    check. Returns the rows purged.
+    """
+    keys = sorted({row['s3_key'] for row in tombstones if row['s3_key']})
+    conn = get_db_connection(shard)
+    try:
+        live = set()
+        with conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                live.update(tuple(row) for row in conn.execute(
+                    f"""SELECT bucket, s3_key FROM images
+                        WHERE deleted_at IS NULL AND s3_key IN ({", ".join("?" for _ in chunk)})""",
+                    chunk
+                ))
+        orphaned = [row for row in tombstones if row['s3_key'] and (row['bucket'], row['s3_key']) not in live]
+        stuck = set(delete_objects(orphaned)) if orphaned else set()
+        with conn:
+            cursor = conn.executemany("DELETE FROM images WHERE id = ? AND deleted_at IS NOT NULL",
+                                      [(row['id'],) for row in tombstones if row['id'] not in stuck])
+        return cursor.rowcount
+    finally:
+        conn.close()
 
 
-def get_images_by_username(username):
-    conn = get_db_connection()
-    query = '''
+def get_images_by_username(username, include_deleted=False):
+    conn = get_db_connection(shard_for(username))
+    query = f'''
             SELECT i.image_url
             FROM images i
                      JOIN users u ON i.user_id = u.id
-            WHERE u.username = ?
+            WHERE u.username = ? {"" if include_deleted else "AND i.deleted_at IS NULL"}
             ORDER BY i.created_at DESC \
             '''
     rows = conn.execute(query, (username,)).fetchall()
@@ -120,36 +499,109 @@ def get_images_by_username(username):
     return [row['image_url'] for row in rows]
 
 
+def get_image_details(username, image_url):
+    conn = get_db_connection(shard_for(username))
+    query = f'''
+            SELECT {IMAGE_DETAIL_FIELDS}, i.bucket, i.s3_key
+            FROM images i
+                     JOIN users u ON i.user_id = u.id
+            WHERE u.username = ? AND i.image_url = ? AND i.deleted_at IS NULL
+            '''
+    row = conn.execute(query, (username, image_url)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def get_image_details_by_username(username):
+    return list(iter_image_details(username))
+
+
+def iter_image_details(username, category=None, since=None, until=None, batch_size=500,
+                       fields=IMAGE_DETAIL_FIELDS):
+    """
+    Yield image rows for a user, newest first, so callers can stream large
+    libraries without materialising them. Rows are read in keyset pages on
+    (created_at, id), each a short query of its own: an open cursor would
+    hold the shard's read lock, and so block its writers, for as long as the
+    caller takes to send the rows. Filters are applied in SQL: category
+    matches the key's category segment, since is inclusive and until is
+    exclusive.
+    """
+    conditions = ["u.username = ?", "i.deleted_at IS NULL"]
+    params = [username]
+    if category:
+        # The key's directory is {username}/{category}/, after a hash prefix in the hashed layout
+        # (see keyLayout); a bare substring match would also hit the username or the prefix.
+        # Rows without s3_key fall back to the key in the URL, as in _migrate_shard.
+        key = "COALESCE(i.s3_key, substr(i.image_url, instr(i.image_url, '.s3.amazonaws.com/') + 18))"
+        directory = f"rtrim({key}, replace({key}, '/', ''))"
+        conditions.append(f"({directory} = ? OR substr({directory}, instr({directory}, '/') + 1) = ?)")
+        params.extend([f"{username}/{category}/"] * 2)
+    if since:
+        conditions.append("i.created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("i.created_at < ?")
+        params.append(until)
+    query = f'''
+            SELECT i.id AS page_id, i.created_at AS page_created_at, {fields}
+            FROM images i
+                     JOIN users u ON i.user_id = u.id
+            WHERE {" AND ".join(conditions)} {{after}}
+            ORDER BY i.created_at DESC, i.id DESC
+            LIMIT ?
+            '''
+    after = ()
+    while True:
+        conn = get_db_connection(shard_for(username))
+        try:
+            rows = conn.execute(
+                query.format(after="AND (i.created_at < ? OR (i.created_at = ? AND i.id < ?))" if after else ""),
+                (*params, *after, batch_size)
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            image = dict(row)
+            del image['page_id'], image['page_created_at']
+            yield image
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+        after = (last['page_created_at'], last['page_created_at'], last['page_id'])
+
+
 def category_exists(username, category_name):
-    user_id = get_user_id(username)
-    if not user_id:
-        return None
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for(username))
     existing = conn.execute(
-        "SELECT id FROM categories WHERE user_id = ? AND name = ?",
-        (user_id, category_name)
+        """SELECT c.id FROM categories c JOIN users u ON c.user_id = u.id
+           WHERE u.username = ? AND c.name = ?""",
+        (username, category_name)
     ).fetchone()
     conn.close()
     return existing['id'] if existing else None
 
 
-def create_category_for_user(username, category_name):
-    existing_id = category_exists(username, category_name)
-    if existing_id:
-        return {'success': False, 'message': 'Category already exists', 'category_id': existing_id}
+def _create_category(conn, username, category_name):
+    user_id = _resolve_user(conn, username)
+    rows = conn.execute(
+        "INSERT INTO categories (user_id, name) VALUES (?, ?) ON CONFLICT (user_id, name) DO NOTHING RETURNING id",
+        (user_id, category_name)
+    ).fetchall()
+    if not rows:
+        existing = conn.execute("SELECT id FROM categories WHERE user_id = ? AND name = ?",
+                                (user_id, category_name)).fetchone()
+        return {'success': False, 'message': 'Category already exists', 'category_id': existing['id']}
+    _record_change(conn, user_id, 'category', 'insert', category_name)
+    return {'success': True, 'message': 'Category created', 'category_id': rows[0]['id']}
 
-    user_id = get_or_create_user(username)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO categories (user_id, name) VALUES (?, ?)", (user_id, category_name))
-    conn.commit()
-    category_id = cursor.lastrowid
-    conn.close()
-    return {'success': True, 'message': 'Category created', 'category_id': category_id}
+
+def create_category_for_user(username, category_name):
+    return run_write(shard_for(username), _create_category, username, category_name)
 
 
 def get_categories_from_user(username):
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for(username))
     query = '''
             SELECT c.id, c.name, c.created_at
             FROM categories c
@@ -160,3 +612,241 @@ def get_categories_from_user(username):
     rows = conn.execute(query, (username,)).fetchall()
     conn.close()
     return [dict(row) for row in rows]
+
+
+def get_category_image_rows(username, category_name):
+    """
+    Rows (id, url, bucket, s3_key, size_bytes) whose URL contains the category segment;
+    callers refine by key. Deleted images are included so they move with
+    the category and can still be restored afterwards.
+    """
+    conn = get_db_connection(shard_for(username))
+    query = '''
+            SELECT i.id, i.image_url AS url, i.bucket, i.s3_key, i.size_bytes
+            FROM images i
+                     JOIN users u ON i.user_id = u.id
+            WHERE u.username = ? AND instr(i.image_url, ?) > 0
+            '''
+    rows = conn.execute(query, (username, f"/{category_name}/")).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def get_pending_category_move(username, source):
+    conn = get_db_connection(shard_for(username))
+    row = conn.execute(
+        """SELECT m.* FROM category_moves m JOIN users u ON m.user_id = u.id
+           WHERE u.username = ? AND m.source = ? AND m.status != 'done'""",
+        (username, source)
+    ).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def create_category_move(username, source, target, merge):
+    conn = get_db_connection(shard_for(username))
+    cursor = conn.execute(
+        """INSERT INTO category_moves (user_id, source, target, merge)
+           SELECT id, ?, ?, ? FROM users WHERE username = ?""",
+        (source, target, int(merge), username)
+    )
+    conn.commit()
+    move = dict(conn.execute("SELECT * FROM category_moves WHERE id = ?", (cursor.lastrowid,)).fetchone())
+    conn.close()
+    return move
+
+
+def apply_category_move(username, move, url_updates):
+    """
+    Rewrite the moved images' URLs and the category rows in one transaction
+    and advance the move to its 'deleting' phase. url_updates is a list of
+    (image_id, new_bucket, new_key, new_url).
+    """
+    user_id, source, target = move['user_id'], move['source'], move['target']
+    conn = get_db_connection(shard_for(username))
+    with conn:
+        for image_id, bucket, key, url in url_updates:
+            _move_image(conn, image_id, bucket, key, url)
+        if move['merge']:
+            moved = conn.execute("DELETE FROM categories WHERE user_id = ? AND name = ?", (user_id, source))
+        else:
+            moved = conn.execute("UPDATE categories SET name = ? WHERE user_id = ? AND name = ?",
+                                 (target, user_id, source))
+        if moved.rowcount:
+            _record_change(conn, user_id, 'category', 'delete', source)
+        if not move['merge'] and moved.rowcount:
+            _record_change(conn, user_id, 'category', 'insert', target)
+        elif conn.execute("INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)",
+                          (user_id, target)).rowcount:
+            _record_change(conn, user_id, 'category', 'insert', target)
+        conn.execute("UPDATE category_moves SET status = 'deleting' WHERE id = ?", (move['id'],))
+    conn.close()
+
+
+def _move_image(conn, image_id, bucket, key, url, old_key=None):
+    """Repoint one image row, logging the URL change as a delete and an insert; False if it did not match"""
+    row = conn.execute("SELECT user_id, image_url, s3_key, deleted_at FROM images WHERE id = ?",
+                       (image_id,)).fetchone()
+    if row is None or (old_key is not None and row['s3_key'] != old_key):
+        return False
+    conn.execute("UPDATE images SET bucket = ?, s3_key = ?, image_url = ? WHERE id = ?",
+                 (bucket, key, url, image_id))
+    # Deleted images are invisible to clients, so their moves are not logged
+    if row['deleted_at'] is None and row['image_url'] != url:
+        _record_change(conn, row['user_id'], 'image', 'delete', row['image_url'])
+        _record_change(conn, row['user_id'], 'image', 'insert', url)
+    return True
+
+
+def finish_category_move(username, move_id):
+    conn = get_db_connection(shard_for(username))
+    conn.execute("UPDATE category_moves SET status = 'done' WHERE id = ?", (move_id,))
+    conn.commit()
+    conn.close()
+
+
+def get_image_locations(shard, after_id, limit):
+    """Rows (id, url, bucket, s3_key, size_bytes) of a shard's images, deleted ones included, in id order"""
+    conn = get_db_connection(shard)
+    rows = conn.execute(
+        """SELECT id, image_url AS url, bucket, s3_key, size_bytes FROM images
+           WHERE id > ? AND s3_key IS NOT NULL ORDER BY id LIMIT ?""",
+        (after_id, limit)
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def relocate_images(shard, moves):
+    """
+    Point a shard's rows at their new objects. moves is a list of (image_id, old_key,
+    new_bucket, new_key, new_url); a row whose key changed in the meantime
+    (e.g. by a category rename) is left alone. Returns the ids updated.
+    """
+    conn = get_db_connection(shard)
+    updated = []
+    with conn:
+        for image_id, old_key, bucket, key, url in moves:
+            if _move_image(conn, image_id, bucket, key, url, old_key):
+                updated.append(image_id)
+    conn.close()
+    return updated
+
+
+def get_referenced_locations(locations):
+    """The (bucket, key) pairs from locations that some image row, deleted or not, in any shard still points at"""
+    locations = set(locations)
+    if not locations:
+        return set()
+    return set().union(*for_each_shard(_referenced_locations, locations))
+
+
+def _referenced_locations(shard, locations):
+    conn = get_db_connection(shard)
+    referenced = set()
+    for bucket, key in locations:
+        if conn.execute("SELECT 1 FROM images WHERE s3_key = ? AND bucket = ?", (key, bucket)).fetchone():
+            referenced.add((bucket, key))
+    conn.close()
+    return referenced
+
+
+def _shard_stats(shard):
+    conn = get_db_connection(shard)
+    row = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM users) AS users,
+               (SELECT COUNT(*) FROM images WHERE deleted_at IS NULL) AS images,
+               (SELECT COUNT(*) FROM images WHERE deleted_at IS NOT NULL) AS deleted_images,
+               (SELECT COALESCE(SUM(size_bytes), 0) FROM images WHERE deleted_at IS NULL) AS bytes,
+               (SELECT COUNT(*) FROM categories) AS categories
+    ''').fetchone()
+    conn.close()
+    return {'shard': shard, **dict(row)}
+
+
+def get_stats():
+    """Totals across every shard, queried in parallel, plus the per-shard breakdown"""
+    shards = for_each_shard(_shard_stats)
+    totals = {field: sum(shard[field] for shard in shards) for field in shards[0] if field != 'shard'}
+    return {**totals, 'shards': shards}
+
+
+def change_log_bounds(conn):
+    """(compacted_through, latest seq ever assigned) for a shard's change log"""
+    floor = conn.execute("SELECT value FROM change_log_state WHERE key = 'compacted_through'").fetchone()
+    latest = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return (floor['value'] if floor else 0), (latest['seq'] if latest else 0)
+
+
+def get_changes(username, since, limit):
+    """
+    A user's changes after seq `since`, oldest first, with the seq to pass as
+    `since` next time. reset=True means `since` predates the compacted part of
+    the log (or comes from a rebuilt one): the client must re-list everything
+    and continue from `next`.
+    """
+    conn = get_db_connection(shard_for(username))
+    # Read the bounds first: anything committed after this has a higher seq than latest
+    floor, latest = change_log_bounds(conn)
+    if since < floor or since > latest:
+        conn.close()
+        return {'changes': [], 'next': latest, 'has_more': False, 'reset': True}
+    rows = conn.execute(
+        """SELECT c.seq, c.kind, c.op, c.item, c.created_at
+           FROM changes c JOIN users u ON c.user_id = u.id
+           WHERE u.username = ? AND c.seq > ?
+           ORDER BY c.seq
+           LIMIT ?""",
+        (username, since, limit + 1)
+    ).fetchall()
+    conn.close()
+    changes = [dict(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    last = changes[-1]['seq'] if changes else since
+    # Other users' changes advance latest too; skipping past them keeps the client ahead of compaction
+    return {'changes': changes, 'next': last if has_more else max(last, latest), 'has_more': has_more,
+            'reset': False}
+
+
+def _compact_shard(shard, retention_seconds, batch_size):
+    conn = get_db_connection(shard)
+    removed = 0
+    # Only the newest entry per item decides a client's state, so older ones can always go.
+    # Walk the log in seq ranges so each transaction is short.
+    low, high = conn.execute("SELECT COALESCE(MIN(seq), 0) - 1, COALESCE(MAX(seq), 0) FROM changes").fetchone()
+    while low < high:
+        with conn:
+            removed += conn.execute('''
+                DELETE FROM changes
+                WHERE seq > ? AND seq <= ?
+                  AND seq < (SELECT MAX(newer.seq) FROM changes newer
+                             WHERE newer.user_id = changes.user_id AND newer.kind = changes.kind
+                               AND newer.item = changes.item)
+            ''', (low, low + batch_size)).rowcount
+        low += batch_size
+    while True:
+        with conn:
+            expired = conn.execute(
+                """DELETE FROM changes WHERE seq IN
+                       (SELECT seq FROM changes WHERE created_at < datetime('now', ?) ORDER BY seq LIMIT ?)
+                   RETURNING seq""",
+                (f'-{int(retention_seconds)} seconds', batch_size)
+            ).fetchall()
+            if expired:
+                # Clients that have not synced past these entries can no longer catch up incrementally
+                conn.execute(
+                    """INSERT INTO change_log_state (key, value) VALUES ('compacted_through', ?)
+                       ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)""",
+                    (max(row['seq'] for row in expired),)
+                )
+        removed += len(expired)
+        if len(expired) < batch_size:
+            break
+    conn.close()
+    return removed
+
+
+def compact_changes(retention_seconds=None):
+    """Drop superseded change-log entries and those older than the retention window; returns the count"""
+    retention_seconds = CHANGE_LOG_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+    return sum(for_each_shard(_compact_shard, retention_seconds, CHANGE_LOG_COMPACT_BATCH))
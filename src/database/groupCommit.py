@@ -0,0 +1,97 @@
+"""
+Group-commit writer: collects write operations from concurrent requests and
+commits them to SQLite in a single transaction, so a burst of uploads costs
+one fsync and one writer-lock acquisition instead of one per row.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Runs a background thread that owns one SQLite connection. Operations are
+    callables taking (conn, *args); each one runs inside its own savepoint so a
+    failing row only fails its own future, not the whole batch.
+    """
+
+    def __init__(self, connect, max_delay=0.005, max_batch=64):
+        self._connect = connect
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.batches_committed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, *args):
+        """Queue an operation and return a Future resolving to its return value"""
+        future = Future()
+        self._queue.put((future, operation, args))
+        return future
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        conn = self._connect()
+        conn.isolation_level = None  # transactions are managed explicitly below
+        try:
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch = [first]
+                stop = self._fill_batch(batch)
+                self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _fill_batch(self, batch):
+        """Wait up to max_delay for more operations; returns True if close() was called"""
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return True
+            batch.append(item)
+        return False
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, operation, args in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((future, operation(conn, *args), None))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _, _ in batch:
+                future.set_exception(e)
+            return
+        self.batches_committed += 1
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
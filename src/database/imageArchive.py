@@ -0,0 +1,115 @@
+"""
+Streaming ZIP archives of a user's images. The archive is written by
+zipfile into a sink that is drained after every write, so it is sent as it
+is produced and never staged in memory or on disk. While one object is being
+written the next few are fetched in parallel; only objects up to
+ARCHIVE_PREFETCH_MAX_MB are prefetched whole, larger ones are streamed in
+chunks when their turn comes, which keeps memory per download bounded by
+ARCHIVE_PREFETCH * ARCHIVE_PREFETCH_MAX_MB.
+"""
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from botocore.exceptions import BotoCoreError, ClientError
+from . import storageAws
+
+ARCHIVE_PREFETCH = int(os.getenv('ARCHIVE_PREFETCH', '4'))
+ARCHIVE_PREFETCH_MAX_BYTES = int(os.getenv('ARCHIVE_PREFETCH_MAX_MB', '8')) * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class _Sink:
+    """Write-only file object for zipfile that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yields the pending bytes as one chunk, or nothing"""
+        if self.chunks:
+            data = b''.join(self.chunks)
+            self.chunks = []
+            yield data
+
+
+def _zip_info(entry):
+    info = zipfile.ZipInfo(entry['name'], _date_time(entry.get('created_at')))
+    # Images are already compressed, so deflating them would only cost CPU
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = entry.get('size') or 0
+    return info
+
+
+def _date_time(created_at):
+    try:
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').timetuple()[:6]
+    except (TypeError, ValueError):
+        return (1980, 1, 1, 0, 0, 0)
+
+
+def stream_archive(entries):
+    """
+    Yield a ZIP of entries, dicts with name, bucket, key, size and created_at.
+    Objects that cannot be read are listed in a MISSING.txt entry instead,
+    since the response status has already been sent by then.
+    """
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    pool = ThreadPoolExecutor(max_workers=ARCHIVE_PREFETCH, thread_name_prefix='archive')
+    entries = iter(entries)
+    window = deque()
+    missing = []
+
+    def fill():
+        while len(window) < ARCHIVE_PREFETCH:
+            entry = next(entries, None)
+            if entry is None:
+                return
+            small = entry.get('size') is not None and entry['size'] <= ARCHIVE_PREFETCH_MAX_BYTES
+            future = pool.submit(storageAws.get_image, entry['bucket'], entry['key']) if small else None
+            window.append((entry, future))
+
+    try:
+        fill()
+        while window:
+            entry, future = window.popleft()
+            fill()
+            info = _zip_info(entry)
+            if future is not None:
+                data = future.result()
+                if data is None:
+                    missing.append(entry['name'])
+                    continue
+                with archive.open(info, 'w') as f:
+                    f.write(data)
+                yield from sink.drain()
+                continue
+            body = storageAws.open_image(entry['bucket'], entry['key'])
+            if body is None:
+                missing.append(entry['name'])
+                continue
+            # The size may be unknown or stale, so allow for entries over 4 GB
+            with archive.open(info, 'w', force_zip64=True) as f:
+                try:
+                    for chunk in body.iter_chunks(CHUNK_SIZE):
+                        f.write(chunk)
+                        yield from sink.drain()
+                except (BotoCoreError, ClientError, OSError) as e:
+                    print(f"Archive read of {entry['key']} failed: {e}")
+                    missing.append(f"{entry['name']} (incomplete)")
+            yield from sink.drain()
+        if missing:
+            archive.writestr('MISSING.txt', 'Could not be read from storage:\n' + '\n'.join(missing) + '\n')
+        archive.close()
+        yield from sink.drain()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,142 @@
+"""
+Background garbage collection of deleted images. Deleting an image only
+tombstones its row (deleted_at), so the request is a single local write and
+the image can be restored during the retention window. Once the window has
+passed, the collector removes the S3 objects with batched DeleteObjects and
+then purges the rows. A row whose object fails to delete is left for the
+next pass, so S3 and the database converge instead of diverging.
+Before an object is deleted the collector checks that no live row uses its
+location and that its ETag is still the deleted image's, so a re-upload of
+the same name is never collected. No database lock is held while S3 is
+called. Only one worker per host collects at a time.
+The same thread compacts the change log (see database.compact_changes) on
+its first pass and hourly after, under the same lock.
+"""
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+from . import database
+from . import storageAws
+
+RETENTION_SECONDS = int(os.getenv('IMAGE_DELETE_RETENTION_SECONDS', '3600'))
+GC_INTERVAL = float(os.getenv('IMAGE_GC_INTERVAL_SECONDS', '60'))
+# The change log is compacted on the collector's thread, at most this often
+CHANGE_LOG_COMPACT_INTERVAL = 3600
+GC_BATCH_SIZE = min(int(os.getenv('IMAGE_GC_BATCH_SIZE', '1000')), storageAws.DELETE_BATCH_SIZE)
+
+_thread = None
+_thread_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def collect(retention_seconds=None, batch_size=None):
+    """
+    Collect every expired tombstone, shards in parallel; returns {'purged',
+    'objects_deleted', 'failed'}. Waits for a pass already running in
+    another worker rather than racing it over the same tombstones.
+    """
+    with _exclusive(blocking=True):
+        return _collect(retention_seconds, batch_size)
+
+
+def compact():
+    """Compact the change log now; waits for a collector pass in another worker to finish"""
+    with _exclusive(blocking=True):
+        return database.compact_changes()
+
+
+def _collect(retention_seconds=None, batch_size=None):
+    retention_seconds = RETENTION_SECONDS if retention_seconds is None else retention_seconds
+    results = database.for_each_shard(_collect_shard, retention_seconds, batch_size or GC_BATCH_SIZE)
+    return {field: sum(result[field] for result in results) for field in ('purged', 'objects_deleted', 'failed')}
+
+
+@contextmanager
+def _exclusive(blocking):
+    """
+    Hold the host-wide collector lock, a file beside the database, so one
+    worker collects at a time. Yields False if not blocking and it is taken.
+    """
+    with open(database.DB_NAME + '.gc.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _collect_shard(shard, retention_seconds, batch_size):
+    totals = {'purged': 0, 'objects_deleted': 0, 'failed': 0}
+
+    def delete_objects(tombstones):
+        locations = {}
+        for row in tombstones:
+            locations.setdefault((row['bucket'], row['s3_key']), []).append(row)
+        heads = storageAws.head_objects(list(locations))
+        if heads is None:
+            totals['failed'] += len(locations)
+            return [row['id'] for row in tombstones]
+        # An object whose ETag no longer matches was uploaded again after the delete,
+        # even if its row is not written yet; only the tombstone goes
+        doomed = [location for location, rows in locations.items()
+                  if location in heads and any(row['etag'] in (None, heads[location].get('ETag')) for row in rows)]
+        failed = storageAws.delete_locations(doomed)
+        totals['objects_deleted'] += len(doomed) - len(failed)
+        totals['failed'] += len(failed)
+        return [row['id'] for location in failed for row in locations[location]]
+
+    while True:
+        tombstones = database.get_expired_tombstones(shard, retention_seconds, batch_size)
+        if not tombstones:
+            break
+        failed_before = totals['failed']
+        totals['purged'] += database.purge_tombstones(shard, tombstones, delete_objects)
+        if totals['failed'] > failed_before:
+            # Retry failures on the next pass rather than spinning on them now
+            break
+    return totals
+
+
+def _run():
+    # Compact on the first pass too: workers recycled within the interval would otherwise never do it
+    compacted_at = None
+    while not _stop.wait(GC_INTERVAL):
+        with _exclusive(blocking=False) as acquired:
+            if not acquired:
+                # Another worker on this host is collecting
+                continue
+            try:
+                result = _collect()
+                if result['purged'] or result['failed']:
+                    print(f"Image GC: purged {result['purged']}, {result['failed']} objects failed to delete")
+                if compacted_at is None or time.monotonic() - compacted_at >= CHANGE_LOG_COMPACT_INTERVAL:
+                    compacted_at = time.monotonic()
+                    database.compact_changes()
+            except Exception as e:
+                print(f"Image GC pass failed: {e}")
+
+
+def ensure_started(enabled=True):
+    """Start this process's collector thread; lazy so each gunicorn worker starts its own after fork"""
+    global _thread
+    if not enabled or GC_INTERVAL <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _stop.clear()
+            _thread = threading.Thread(target=_run, name='image-gc', daemon=True)
+            _thread.start()
+
+
+def stop():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
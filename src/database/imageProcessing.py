@@ -0,0 +1,85 @@
+"""
+Image inspection and transformation helpers used by uploads and the resize proxy.
+"""
+from io import BytesIO
+from PIL import Image, ImageOps, features
+
+# Enough leading bytes to reach the size header of PNG, GIF, WebP and most JPEGs
+HEADER_BYTES = 64 * 1024
+
+
+def read_dimensions(header):
+    """
+    Return (width, height) parsed from the leading bytes of an image,
+    or (None, None) if the format is unknown or the header is incomplete.
+    """
+    try:
+        with Image.open(BytesIO(header)) as img:
+            return img.size
+    except Exception:
+        # Pillow raises a mix of OSError, SyntaxError and ValueError on bad headers
+        return None, None
+
+
+def placeholder_color(stream):
+    """
+    Average colour of the image as '#rrggbb' for use as a loading placeholder,
+    or None if it cannot be decoded. JPEGs are decoded at reduced scale.
+    """
+    try:
+        with Image.open(stream) as img:
+            img.draft('RGB', (64, 64))
+            pixel = img.convert('RGB').resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+            return '#%02x%02x%02x' % pixel
+    except Exception:
+        return None
+
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def negotiate_format(accepted, original_format):
+    """
+    Pick the output format from the mime types a client explicitly accepts,
+    preferring AVIF, then WebP, then the original's format (JPEG or PNG).
+    A bare */* does not count, so clients only get modern formats they asked for.
+    """
+    accepted = set(accepted)
+    if 'image/avif' in accepted and features.check('avif'):
+        return 'avif'
+    if 'image/webp' in accepted and features.check('webp'):
+        return 'webp'
+    return 'jpeg' if original_format == 'image/jpeg' else 'png'
+
+
+class UnsupportedImage(Exception):
+    """The stored bytes are not an image Pillow can decode (or are too large to)"""
+
+
+def render_variant(data, width=None, height=None, quality=80, fmt='png'):
+    """
+    Resize to fit within width x height (never upscaling) and encode as fmt.
+    Raises UnsupportedImage if data cannot be decoded.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            if width or height:
+                box = (width or img.width, height or img.height)
+                # Lets the JPEG decoder skip work by decoding at a reduced scale
+                img.draft('RGB', box)
+            img = ImageOps.exif_transpose(img)
+            if width or height:
+                img.thumbnail(box)
+            if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            out = BytesIO()
+            img.save(out, format=fmt.upper(), quality=quality)
+            return out.getvalue()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and truncated-file errors are OSErrors
+        raise UnsupportedImage(str(e)) from e
@@ -0,0 +1,63 @@
+"""
+Where an image's object lives in S3. The flat layout keys objects as
+{username}/{category}/{filename}, which puts all of a user's requests on one
+prefix and so under one prefix's request-rate limit. The hashed layout adds
+a short prefix taken from a hash of the whole path,
+
+    3f/{username}/{category}/{filename}
+
+spreading even a single user's objects over 16**KEY_SHARD_CHARS prefixes,
+and can spread them over several buckets as well. The database stores each
+image's resolved bucket and key, so changing the layout only affects new
+uploads until keyMigration has moved the existing objects.
+"""
+import hashlib
+import os
+
+KEY_LAYOUT = os.getenv('KEY_LAYOUT', 'flat')
+KEY_SHARD_CHARS = int(os.getenv('KEY_SHARD_CHARS', '2'))
+# Buckets objects are spread over in the hashed layout (defaults to BUCKET_NAME alone)
+S3_BUCKETS = [name.strip() for name in os.getenv('S3_BUCKETS', '').split(',') if name.strip()]
+
+
+def buckets(default_bucket):
+    """Buckets in use, primary first"""
+    return S3_BUCKETS or [default_bucket]
+
+
+def _digest(path):
+    return hashlib.sha256(path.encode()).hexdigest()
+
+
+def locate(bucket_names, username, category, filename):
+    """(bucket, key) for an image under the configured layout"""
+    path = f"{username}/{category}/{filename}"
+    if KEY_LAYOUT != 'hashed':
+        return bucket_names[0], path
+    digest = _digest(path)
+    bucket = bucket_names[int(digest[KEY_SHARD_CHARS:KEY_SHARD_CHARS + 8], 16) % len(bucket_names)]
+    return bucket, f"{digest[:KEY_SHARD_CHARS]}/{path}"
+
+
+def candidates(bucket_names, username, category, filename, legacy_bucket=None):
+    """
+    Locations an image may be stored at: the current layout, then the flat
+    one it may predate, in the primary bucket and in legacy_bucket (the
+    BUCKET_NAME flat objects were written to before S3_BUCKETS was set)
+    """
+    path = f"{username}/{category}/{filename}"
+    locations = [locate(bucket_names, username, category, filename), (bucket_names[0], path)]
+    if legacy_bucket:
+        locations.append((legacy_bucket, path))
+    return list(dict.fromkeys(locations))
+
+
+def parse(key):
+    """(username, category, filename) from a key in either layout, or None"""
+    parts = key.split('/') if key else []
+    # A hex first segment alone is not enough: flat keys of users named e.g. "cafe" have one too
+    if len(parts) == 4 and parts[0] and _digest('/'.join(parts[1:])).startswith(parts[0]):
+        parts = parts[1:]
+    if len(parts) != 3 or not all(parts):
+        return None
+    return tuple(parts)
@@ -0,0 +1,89 @@
+"""
+Moves existing objects to the key layout currently configured in keyLayout
+(e.g. after switching KEY_LAYOUT to hashed or adding buckets to S3_BUCKETS).
+Images are processed in id order in batches: the objects are copied in
+parallel, the rows are repointed, then the old objects are deleted. Running
+it again after an interruption picks up whatever is still in the old place.
+
+    cd src && python -m database.keyMigration [--concurrency 32] [--dry-run]
+"""
+import argparse
+import json
+import os
+from . import database
+from . import keyLayout
+from . import storageAws
+
+MIGRATION_CONCURRENCY = int(os.getenv('KEY_MIGRATION_CONCURRENCY', '32'))
+
+
+def _pending_moves(bucket_names, rows):
+    """[(row, (bucket, key))] for rows not yet at their configured location, and the unparseable count"""
+    moves, skipped = [], 0
+    for row in rows:
+        parts = keyLayout.parse(row['s3_key'])
+        if parts is None:
+            skipped += 1
+            continue
+        dest = keyLayout.locate(bucket_names, *parts)
+        if dest != (row['bucket'], row['s3_key']):
+            moves.append((row, dest))
+    return moves, skipped
+
+
+def migrate(bucket_names, concurrency=None, batch_size=500, dry_run=False):
+    """Returns {'moved', 'failed', 'skipped'} counts of image rows"""
+    concurrency = concurrency or MIGRATION_CONCURRENCY
+    totals = {'moved': 0, 'failed': 0, 'skipped': 0}
+    for shard in range(database.DB_SHARDS):
+        _migrate_shard(shard, bucket_names, concurrency, batch_size, dry_run, totals)
+    return totals
+
+
+def _migrate_shard(shard, bucket_names, concurrency, batch_size, dry_run, totals):
+    after_id = 0
+    while True:
+        rows = database.get_image_locations(shard, after_id, batch_size)
+        if not rows:
+            return
+        after_id = rows[-1]['id']
+        moves, skipped = _pending_moves(bucket_names, rows)
+        totals['skipped'] += skipped
+        if dry_run:
+            totals['moved'] += len(moves)
+            continue
+
+        # A deleted row and its re-upload can share an object; copy it once
+        copies = {(row['bucket'], row['s3_key']): (row['bucket'], row['s3_key'], *dest, row['size_bytes'])
+                  for row, dest in moves}
+        failed = {(copy[0], copy[1]) for copy in storageAws.copy_images(list(copies.values()), concurrency)}
+        relocations = [(row['id'], row['s3_key'], *dest, storageAws.object_url(*dest))
+                       for row, dest in moves if (row['bucket'], row['s3_key']) not in failed]
+        updated = set(database.relocate_images(shard, relocations))
+        totals['moved'] += len(updated)
+        totals['failed'] += len(moves) - len(updated)
+
+        # Old objects, and copies whose row changed under us, are removed unless still referenced
+        leftovers = {(row['bucket'], row['s3_key']) if row['id'] in updated else dest
+                     for row, dest in moves if (row['bucket'], row['s3_key']) not in failed}
+        referenced = database.get_referenced_locations(leftovers)
+        undeleted = storageAws.delete_locations([location for location in leftovers if location not in referenced])
+        if undeleted:
+            print(f"Failed to delete {len(undeleted)} old objects; they are no longer referenced")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=MIGRATION_CONCURRENCY, help="parallel copies")
+    parser.add_argument("--batch-size", type=int, default=500, help="images per batch")
+    parser.add_argument("--dry-run", action="store_true", help="count images that would move")
+    args = parser.parse_args()
+    database.migrate_db()
+    bucket_names = keyLayout.buckets(os.getenv('BUCKET_NAME'))
+    if not bucket_names[0]:
+        parser.error("BUCKET_NAME or S3_BUCKETS must be set")
+    print(json.dumps(migrate(bucket_names, args.concurrency, args.batch_size, args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
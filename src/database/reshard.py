@@ -0,0 +1,106 @@
+"""
+Offline resharding. Copies every user, with their images, categories and
+category moves, from the current shard files into a new set of shard files
+laid out for a different shard count. Stop the app first, then
+
+    cd src && python -m database.reshard --to 4
+
+and restart with DATABASE_SHARDS=4. Shard files are named after the shard
+count, so the old files are left untouched and switching back only needs the
+old DATABASE_SHARDS value.
+
+The change log is not copied: the new shards continue its sequence from the
+highest seq assigned so far and mark everything up to it as compacted, so
+sync clients re-list once and carry on from there.
+"""
+import argparse
+import json
+import os
+import sqlite3
+from . import database
+
+IMAGE_FIELDS = ['image_url', *database.IMAGE_COLUMNS, *database.TOMBSTONE_COLUMNS, 'created_at']
+CATEGORY_FIELDS = ['name', 'created_at']
+MOVE_FIELDS = ['source', 'target', 'merge', 'status', 'created_at']
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _copy_rows(source, target, table, fields, old_user_id, new_user_id):
+    rows = source.execute(f"SELECT {', '.join(fields)} FROM {table} WHERE user_id = ? ORDER BY id",
+                          (old_user_id,)).fetchall()
+    target.executemany(
+        f"INSERT INTO {table} (user_id, {', '.join(fields)}) VALUES (?, {', '.join('?' for _ in fields)})",
+        [(new_user_id, *row) for row in rows]
+    )
+    return len(rows)
+
+
+def reshard(source_shards, target_shards, force=False):
+    """Returns per-target-shard counts of the users, images and categories copied"""
+    if source_shards == target_shards:
+        raise ValueError("Source and target shard counts are the same")
+    target_paths = [database.shard_path(shard, target_shards) for shard in range(target_shards)]
+    existing = [path for path in target_paths if os.path.exists(path)]
+    if existing and not force:
+        raise FileExistsError(f"Target shard files already exist: {', '.join(existing)}")
+
+    targets = [_connect(path) for path in target_paths]
+    counts = [{'shard': shard, 'users': 0, 'images': 0, 'categories': 0} for shard in range(target_shards)]
+    try:
+        for conn in targets:
+            database.create_schema(conn)
+        last_seq = 0
+        for shard in range(source_shards):
+            source = _connect(database.shard_path(shard, source_shards))
+            last_seq = max(last_seq, database.change_log_bounds(source)[1])
+            source.close()
+        for conn in targets:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('changes', ?)", (last_seq,))
+            conn.execute("INSERT INTO change_log_state (key, value) VALUES ('compacted_through', ?)", (last_seq,))
+        for shard in range(source_shards):
+            source = _connect(database.shard_path(shard, source_shards))
+            for user in source.execute("SELECT id, username, password, created_at FROM users ORDER BY id"):
+                index = database.shard_for(user['username'], target_shards)
+                target = targets[index]
+                new_user_id = target.execute(
+                    "INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)",
+                    (user['username'], user['password'], user['created_at'])
+                ).lastrowid
+                counts[index]['users'] += 1
+                counts[index]['images'] += _copy_rows(source, target, 'images', IMAGE_FIELDS,
+                                                      user['id'], new_user_id)
+                counts[index]['categories'] += _copy_rows(source, target, 'categories', CATEGORY_FIELDS,
+                                                          user['id'], new_user_id)
+                _copy_rows(source, target, 'category_moves', MOVE_FIELDS, user['id'], new_user_id)
+            source.close()
+        for conn in targets:
+            conn.commit()
+    finally:
+        for conn in targets:
+            conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="source", type=int, default=database.DB_SHARDS,
+                        help="current shard count (default: DATABASE_SHARDS)")
+    parser.add_argument("--to", dest="target", type=int, required=True, help="new shard count")
+    parser.add_argument("--force", action="store_true", help="overwrite existing target shard files")
+    args = parser.parse_args()
+    database.DB_SHARDS = args.source
+    database.migrate_db()
+    try:
+        counts = reshard(args.source, args.target, args.force)
+    except (ValueError, FileExistsError) as e:
+        parser.error(str(e))
+    print(json.dumps(counts, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,39 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 import dotenv
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import imageProcessing
+from web import resilience
 
 dotenv.load_dotenv()
 REGION = os.getenv('REGION','us-east-1')
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_SESSION_TOKEN = os.getenv('AWS_SESSION_TOKEN')
+# Point at an S3-compatible endpoint (e.g. a moto server for load tests)
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+# Retries are handled by the resilience layer, so botocore makes a single attempt
+CLIENT_CONFIG = Config(
+    connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT_SECONDS', '3')),
+    read_timeout=float(os.getenv('S3_READ_TIMEOUT_SECONDS', '10')),
+    retries={'total_max_attempts': 1},
+    max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '32')),
+)
+# copy_object is capped at 5 GB; above this size copies use parallel UploadPartCopy
+MULTIPART_COPY_THRESHOLD = 256 * 1024 * 1024
+COPY_TRANSFER_CONFIG = TransferConfig(multipart_threshold=MULTIPART_COPY_THRESHOLD,
+                                      multipart_chunksize=64 * 1024 * 1024)
+DELETE_BATCH_SIZE = 1000
 
 
-def get_client():
-    kwargs = {"region_name": REGION}
+def create_client():
+    kwargs = {"region_name": REGION, "config": CLIENT_CONFIG}
+    if S3_ENDPOINT_URL:
+        kwargs["endpoint_url"] = S3_ENDPOINT_URL
     if AWS_ACCESS_KEY_ID:
         kwargs["aws_access_key_id"] = AWS_ACCESS_KEY_ID
     if AWS_SECRET_ACCESS_KEY:
@@ -21,6 +42,20 @@ def get_client():
         kwargs["aws_session_token"] = AWS_SESSION_TOKEN
     return boto3.client("s3", **kwargs)
 
+
+def get_client():
+    """S3 client whose calls are retried, deadlined, circuit-broken and (for reads) hedged"""
+    return resilience.ResilientClient(create_client())
+
+
+def object_url(bucket_name, s3_key):
+    return f"https://{bucket_name}.s3.amazonaws.com/{s3_key}"
+
+
+def key_from_url(bucket_name, url):
+    prefix = object_url(bucket_name, "")
+    return url[len(prefix):] if url.startswith(prefix) else None
+
 def create_bucket(bucket_name):
     s3 = get_client()
     try:
@@ -118,6 +153,57 @@ def upload_image_direct(bucket_name, file_stream, s3_key):
         return False
 
 
+def upload_image_with_metadata(bucket_name, file_stream, s3_key, content_type=None):
+    """
+    Uploads the stream in a single PUT and returns the object's metadata
+    (size, content type, S3 ETag, pixel dimensions, placeholder colour), or
+    None on failure. Dimensions and colour come from the local stream, so
+    no extra S3 request is needed.
+    """
+    s3 = get_client()
+    header = file_stream.read(imageProcessing.HEADER_BYTES)
+    file_stream.seek(0, os.SEEK_END)
+    size = file_stream.tell()
+    file_stream.seek(0)
+    placeholder = imageProcessing.placeholder_color(file_stream)
+    file_stream.seek(0)
+    kwargs = {"Bucket": bucket_name, "Key": s3_key, "Body": file_stream}
+    if content_type:
+        kwargs["ContentType"] = content_type
+    try:
+        response = s3.put_object(**kwargs)
+    except ClientError as e:
+        print(f"Failed to upload to S3: {e}")
+        return None
+    width, height = imageProcessing.read_dimensions(header)
+    return {
+        "size_bytes": size,
+        "content_type": content_type,
+        "etag": response.get("ETag"),
+        "width": width,
+        "height": height,
+        "placeholder": placeholder,
+    }
+
+
+def get_image(bucket_name, object_name):
+    s3 = get_client()
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=object_name)
+        return response['Body'].read()
+    except ClientError:
+        return None
+
+
+def open_image(bucket_name, object_name):
+    """Streaming body of an object, for reading large objects in chunks, or None"""
+    s3 = get_client()
+    try:
+        return s3.get_object(Bucket=bucket_name, Key=object_name)['Body']
+    except ClientError:
+        return None
+
+
 def list_images_by_prefix(bucket_name, prefix):
     s3 = get_client()
     try:
@@ -127,6 +213,24 @@ def list_images_by_prefix(bucket_name, prefix):
         return []
 
 
+def list_object_sizes(bucket_name, prefix):
+    """Returns {key: size} for every object under prefix (all pages), or None on failure"""
+    s3 = get_client()
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+    sizes = {}
+    try:
+        while True:
+            response = s3.list_objects_v2(**kwargs)
+            for obj in response.get('Contents', []):
+                sizes[obj['Key']] = obj['Size']
+            if not response.get('IsTruncated'):
+                return sizes
+            kwargs["ContinuationToken"] = response['NextContinuationToken']
+    except ClientError as e:
+        print(f"Failed to list {prefix}: {e}")
+        return None
+
+
 def list_images(bucket_name):
     return list_images_by_prefix(bucket_name, "")
 
@@ -142,4 +246,97 @@ def delete_image(bucket_name, object_name):
 
 def get_images_by_user_and_category(bucket_name, username, category=None):
     prefix = f"{username}/{category}/" if category else f"{username}/"
-    return list_images_by_prefix(bucket_name, prefix)
\ No newline at end of file
+    return list_images_by_prefix(bucket_name, prefix)
+
+
+def copy_images(copies, max_workers=16):
+    """
+    Server-side copies through a bounded thread pool. copies is a list of
+    (source_bucket, source_key, dest_bucket, dest_key, size) where size may
+    be None if unknown. Returns the copies that failed.
+    """
+    s3 = get_client()
+
+    def copy_one(source_bucket, source_key, dest_bucket, dest_key, size):
+        source = {'Bucket': source_bucket, 'Key': source_key}
+        if size is not None and size < MULTIPART_COPY_THRESHOLD:
+            s3.copy_object(Bucket=dest_bucket, Key=dest_key, CopySource=source)
+        else:
+            # Managed copy looks up the size and switches to multipart for large objects
+            s3.copy(source, dest_bucket, dest_key, Config=COPY_TRANSFER_CONFIG)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(copy_one, *copy): copy for copy in copies}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except ClientError as e:
+                print(f"Failed to copy {futures[future][1]}: {e}")
+                failed.append(futures[future])
+    return failed
+
+
+def head_objects(locations, max_workers=16):
+    """
+    {(bucket, key): HeadObject response} for the given locations that exist,
+    from parallel HEAD requests; None if any request failed for a reason
+    other than 404.
+    """
+    s3 = get_client()
+
+    def head(bucket_name, key):
+        try:
+            return s3.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    heads = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(head, *location): location for location in locations}
+        try:
+            for future in as_completed(futures):
+                response = future.result()
+                if response is not None:
+                    heads[futures[future]] = response
+        except ClientError as e:
+            print(f"Failed to look up objects: {e}")
+            return None
+    return heads
+
+
+def object_sizes(locations, max_workers=16):
+    """{(bucket, key): size} for the given locations that exist; None if a lookup failed"""
+    heads = head_objects(locations, max_workers)
+    if heads is None:
+        return None
+    return {location: head['ContentLength'] for location, head in heads.items()}
+
+
+def delete_images(bucket_name, keys):
+    """Deletes keys with DeleteObjects in batches of 1,000; returns the keys that failed"""
+    s3 = get_client()
+    failed = []
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        try:
+            response = s3.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        except ClientError as e:
+            print(f"Failed to delete batch: {e}")
+            failed.extend(batch)
+    return failed
+
+
+def delete_locations(locations):
+    """Deletes (bucket, key) pairs, batched per bucket; returns the pairs that failed"""
+    by_bucket = {}
+    for bucket_name, key in locations:
+        by_bucket.setdefault(bucket_name, []).append(key)
+    return [(bucket_name, key) for bucket_name, keys in by_bucket.items()
+            for key in delete_images(bucket_name, keys)]
@@ -0,0 +1,137 @@
+"""
+Size-bounded on-disk LRU cache shared by all gunicorn workers on a host.
+Recency is tracked with file mtimes, so eviction works across processes
+without any shared memory.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class _Flight:
+    """One in-progress produce() that other threads of this process wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class DiskCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._size_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "locks"), exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """Return the cached file path for key (marking it recently used), or None"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._size_lock:
+            if self._size is not None:
+                self._size += len(data)
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def get_or_create(self, key, produce):
+        """
+        Return the path for key, calling produce() to build the bytes on a miss.
+        Concurrent callers for the same key wait for a single producer: threads
+        in this process through an Event, other workers through a file lock.
+        Returns None if produce() returns None; if it raises, the threads
+        waiting on it raise the same exception.
+        """
+        path = self.get(key)
+        if path:
+            return path
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self.get(key)
+        try:
+            with self._file_lock(key):
+                path = self.get(key)
+                if path:
+                    return path
+                data = produce()
+                if data is None:
+                    return None
+                return self.put(key, data)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    @contextmanager
+    def _file_lock(self, key):
+        # Striped over 256 lock files so the lock directory stays bounded
+        stripe = hashlib.sha256(key.encode()).hexdigest()[:2]
+        with open(os.path.join(self.directory, "locks", stripe), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under 90% of max_bytes"""
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            if os.path.basename(root) == "locks":
+                continue
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._size_lock:
+            self._size = total
@@ -119,6 +119,8 @@ fileInput.onchange = async () => {
         try {
             const response = await fetch('/api/upload', {
                 method: 'POST',
+                // Lets the server apply per-user limits without reading the body
+                headers: { 'X-Username': username },
                 body: formData
             });
 
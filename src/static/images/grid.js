@@ -10,13 +10,16 @@ function getParams() {
   return { limit, username, category };
 }
 
-// Fetch images from API
+// Cards per virtualized page; only pages near the viewport keep their cards mounted
+const PAGE_SIZE = 24;
+
+// Fetch image details (URL, placeholder colour, dimensions) from API
 async function fetchImages() {
     const { limit, username, category } = getParams();
     if (!username) return [];
 
     try {
-        let url = `/api/images?username=${encodeURIComponent(username)}`;
+        let url = `/api/images?username=${encodeURIComponent(username)}&details=1`;
         if (category) {
             url += `&category=${encodeURIComponent(category)}`;
         }
@@ -29,21 +32,88 @@ async function fetchImages() {
     }
 }
 
-// Render images dynamically
+function createCard(template, image) {
+  const instance = template.content.cloneNode(true);
+  const card = instance.querySelector('.image-card');
+  const link = instance.querySelector('[data-image-link]');
+  const img = instance.querySelector('[data-image-src]');
+
+  if (card && image.placeholder) card.style.backgroundColor = image.placeholder;
+  if (link) link.href = image.url;
+  if (img) {
+    if (image.width && image.height) {
+      img.width = image.width;
+      img.height = image.height;
+    }
+    img.decoding = 'async';
+    img.addEventListener('load', () => img.classList.add('loaded'));
+    img.src = image.url;
+  }
+  return instance;
+}
+
+function mountPage(page, template) {
+  if (page.mounted) return;
+  page.images.forEach(image => page.el.appendChild(createCard(template, image)));
+  page.el.style.minHeight = '';
+  page.mounted = true;
+}
+
+// Removing the cards also cancels any image downloads still in flight
+function unmountPage(page) {
+  if (!page.mounted) return;
+  page.el.style.minHeight = `${page.el.offsetHeight}px`;
+  page.el.replaceChildren();
+  page.mounted = false;
+}
+
+// Reserve space for unmounted pages using the height of a mounted full page
+function reserveSpace(pages) {
+  const full = pages.find(page => page.mounted && page.images.length === PAGE_SIZE);
+  if (!full) return;
+  const fullHeight = full.el.offsetHeight;
+  pages.forEach(page => {
+    if (!page.mounted) {
+      const share = page.images.length / PAGE_SIZE;
+      page.el.style.minHeight = `${Math.round(fullHeight * share)}px`;
+    }
+  });
+}
+
+// Render images as virtualized pages of cards
 async function renderImages(container, template) {
-  const urls = await fetchImages();
+  const images = await fetchImages();
 
   container.innerHTML = '';
-  urls.forEach(url => {
-    const instance = template.content.cloneNode(true);
-    const link = instance.querySelector('[data-image-link]');
-    const img = instance.querySelector('[data-image-src]');
+  const pages = [];
+  for (let i = 0; i < images.length; i += PAGE_SIZE) {
+    const el = document.createElement('div');
+    el.className = 'image-page';
+    container.appendChild(el);
+    pages.push({ el, images: images.slice(i, i + PAGE_SIZE), mounted: false });
+  }
+  if (pages.length === 0) return;
 
-    if (link) link.href = url;
-    if (img) img.src = url;
+  if (!('IntersectionObserver' in window)) {
+    pages.forEach(page => mountPage(page, template));
+    return;
+  }
 
-    container.appendChild(instance);
-  });
+  mountPage(pages[0], template);
+  reserveSpace(pages);
+  const pageByElement = new Map(pages.map(page => [page.el, page]));
+  const observer = new IntersectionObserver(entries => {
+    entries.forEach(entry => {
+      const page = pageByElement.get(entry.target);
+      if (entry.isIntersecting) {
+        mountPage(page, template);
+      } else {
+        unmountPage(page);
+      }
+    });
+  }, { rootMargin: '800px 0px' });
+  pages.forEach(page => observer.observe(page.el));
+  window.addEventListener('resize', () => reserveSpace(pages));
 }
 
 function preserveQueryParams() {
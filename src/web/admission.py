@@ -0,0 +1,171 @@
+"""
+Per-user admission control: token-bucket rate limits, concurrent upload caps
+and a global in-flight cap for load shedding. State lives in a small SQLite
+file so every gunicorn worker on the host sees the same buckets and slots
+without an external service.
+"""
+import os
+import sqlite3
+import time
+
+# Concurrency slots expire after this long so a crashed worker cannot leak them
+SLOT_TTL_SECONDS = 120
+
+
+class Decision:
+    def __init__(self, allowed, status=200, reason=None, retry_after=0, slots=()):
+        self.allowed = allowed
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        self.slots = list(slots)
+
+
+class AdmissionController:
+    """
+    limits maps a route class (e.g. 'upload', 'list') to a dict with
+    'rate' (tokens per second), 'burst' and optionally 'concurrency'
+    (maximum simultaneous requests per user). max_inflight caps requests
+    in flight across all workers; 0 disables it.
+    """
+
+    def __init__(self, db_path, limits, max_inflight=0):
+        self.db_path = db_path
+        self.limits = limits
+        self.max_inflight = max_inflight
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS buckets
+            (
+                key     TEXT PRIMARY KEY,
+                tokens  REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS slots
+            (
+                id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                key     TEXT NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_slots_key ON slots (key, expires);
+            CREATE TABLE IF NOT EXISTS counters
+            (
+                name  TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        # Limiter state is disposable, so trade durability for latency
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def admit(self, route_class, username):
+        """Check the global cap, the user's token bucket and concurrency cap in one transaction"""
+        limit = self.limits.get(route_class)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM slots WHERE expires <= ?", (now,))
+            decision = self._check(conn, limit, route_class, username, now)
+            if not decision.allowed:
+                conn.execute(
+                    '''INSERT INTO counters (name, value) VALUES (?, 1)
+                       ON CONFLICT(name) DO UPDATE SET value = value + 1''',
+                    (f"rejected.{route_class}.{decision.reason}",)
+                )
+            conn.execute("COMMIT")
+            return decision
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter must not take the app down with it
+            print(f"Admission control unavailable: {e}")
+            return Decision(True)
+        finally:
+            conn.close()
+
+    def _check(self, conn, limit, route_class, username, now):
+        slots = []
+        if self.max_inflight:
+            inflight = conn.execute("SELECT COUNT(*) FROM slots WHERE key = '*'").fetchone()[0]
+            if inflight >= self.max_inflight:
+                return Decision(False, 503, 'overloaded', retry_after=1)
+            slots.append(self._take_slot(conn, '*', now))
+        if limit is None or not username:
+            return Decision(True, slots=slots)
+
+        key = f"{route_class}:{username}"
+        # Concurrency first, so a request turned away for it does not also spend a token
+        concurrency = limit.get('concurrency')
+        if concurrency:
+            active = conn.execute("SELECT COUNT(*) FROM slots WHERE key = ?", (key,)).fetchone()[0]
+            if active >= concurrency:
+                self._release(conn, slots)
+                return Decision(False, 429, 'too_many_concurrent', retry_after=1)
+        retry_after = self._take_token(conn, key, limit['rate'], limit['burst'], now)
+        if retry_after:
+            self._release(conn, slots)
+            return Decision(False, 429, 'rate_limited', retry_after=retry_after)
+        if concurrency:
+            slots.append(self._take_slot(conn, key, now))
+        return Decision(True, slots=slots)
+
+    def _take_token(self, conn, key, rate, burst, now):
+        """Consume one token; returns 0 on success or the seconds until one is available"""
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        if tokens < 1:
+            conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE key = ?", (tokens, now, key))
+            return max(1, int((1 - tokens) / rate + 0.999))
+        conn.execute(
+            '''INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated''',
+            (key, tokens - 1, now)
+        )
+        return 0
+
+    def _take_slot(self, conn, key, now):
+        cursor = conn.execute("INSERT INTO slots (key, expires) VALUES (?, ?)", (key, now + SLOT_TTL_SECONDS))
+        return cursor.lastrowid
+
+    def _release(self, conn, slots):
+        conn.executemany("DELETE FROM slots WHERE id = ?", [(slot,) for slot in slots])
+
+    def release(self, slots):
+        if not slots:
+            return
+        conn = self._connect()
+        try:
+            self._release(conn, slots)
+        except sqlite3.Error as e:
+            print(f"Failed to release admission slots: {e}")
+        finally:
+            conn.close()
+
+    def get_counters(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT name, value FROM counters ORDER BY name").fetchall()
+        conn.close()
+        return dict(rows)
+
+    def reset(self):
+        conn = self._connect()
+        conn.executescript("DELETE FROM buckets; DELETE FROM slots; DELETE FROM counters;")
+        conn.close()
+
+
+def limits_from_env():
+    return {
+        'upload': {
+            'rate': float(os.getenv('RATE_LIMIT_UPLOAD_PER_SECOND', '2')),
+            'burst': float(os.getenv('RATE_LIMIT_UPLOAD_BURST', '20')),
+            'concurrency': int(os.getenv('MAX_CONCURRENT_UPLOADS_PER_USER', '2')),
+        },
+        'list': {
+            'rate': float(os.getenv('RATE_LIMIT_LIST_PER_SECOND', '10')),
+            'burst': float(os.getenv('RATE_LIMIT_LIST_BURST', '50')),
+        },
+    }
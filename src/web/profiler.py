@@ -0,0 +1,183 @@
+"""
+Opt-in per-request profiling. A request is profiled when it carries a valid
+signed token (X-Profile header or _profile query parameter) or is picked by
+1-in-N sampling. Captures are written to a bounded on-disk ring buffer:
+
+- sampling mode (default) writes collapsed stacks ("a;b;c 12" per line), the
+  input format of flamegraph.pl, speedscope and similar tools;
+- deterministic mode writes a cProfile .pstats file.
+
+Each capture has a JSON sidecar with route, user and timings.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampling')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'image-hosting-profiles'))
+PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', '50'))
+EXTENSIONS = {'sampling': '.collapsed', 'deterministic': '.pstats'}
+CAPTURE_ID = re.compile(r'^\d{20}-\d+$')
+
+
+def sign(expires):
+    """Token that enables profiling until the unix time `expires`"""
+    signature = hmac.new(PROFILE_SECRET.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify(token):
+    if not PROFILE_SECRET or not token or '.' not in token:
+        return False
+    expires, _, _ = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(token, sign(int(expires)))
+
+
+def trigger_for(token):
+    """Why this request should be profiled ('signed' or 'sampled'), or None"""
+    if verify(token):
+        return 'signed'
+    if PROFILE_SAMPLE_RATE > 0 and random.randrange(PROFILE_SAMPLE_RATE) == 0:
+        return 'sampled'
+    return None
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread every `interval` seconds"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return sum(self.stacks.values())
+
+
+class DeterministicProfiler:
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def write(self, path):
+        self._profile.dump_stats(path)
+        return None
+
+
+class Capture:
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.mode = PROFILE_MODE if PROFILE_MODE in EXTENSIONS else 'sampling'
+        if self.mode == 'deterministic':
+            self.profiler = DeterministicProfiler()
+        else:
+            self.profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self.profiler.start()
+
+    def finish(self, meta):
+        """Stop profiling, write the capture and its sidecar, and trim the ring buffer"""
+        self.profiler.stop()
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        cpu_ms = (time.thread_time() - self._cpu_start) * 1000
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # Zero-padded nanoseconds so names sort oldest first
+        capture_id = f"{time.time_ns():020d}-{os.getpid()}"
+        samples = self.profiler.write(os.path.join(PROFILE_DIR, capture_id + EXTENSIONS[self.mode]))
+        meta = {
+            'id': capture_id,
+            'mode': self.mode,
+            'trigger': self.trigger,
+            'started_at': self.started_at,
+            'duration_ms': round(duration_ms, 3),
+            'cpu_ms': round(cpu_ms, 3),
+            'samples': samples,
+            **meta,
+        }
+        with open(os.path.join(PROFILE_DIR, capture_id + '.json'), 'w') as f:
+            json.dump(meta, f)
+        _trim()
+        return meta
+
+
+def _trim():
+    sidecars = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for name in sidecars[:max(0, len(sidecars) - PROFILE_MAX_CAPTURES)]:
+        capture_id = name[:-len('.json')]
+        for ext in ('.json', *EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, capture_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_captures():
+    """Capture metadata, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(PROFILE_DIR, name)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return captures
+
+
+def capture_file(capture_id):
+    """Path of a capture's profile, or None if the id is unknown"""
+    if not CAPTURE_ID.match(capture_id):
+        return None
+    for ext in EXTENSIONS.values():
+        path = os.path.join(PROFILE_DIR, capture_id + ext)
+        if os.path.exists(path):
+            return path
+    return None
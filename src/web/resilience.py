@@ -0,0 +1,260 @@
+"""
+Resilience policies for S3 calls: retries with jittered exponential backoff,
+per-operation deadlines, a circuit breaker and optional hedged reads.
+
+Every failure is surfaced as a botocore ClientError (transport errors are
+wrapped, an open breaker raises CircuitOpenError), so callers in storageAws
+keep a single `except ClientError` path.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.exceptions import BotoCoreError, ClientError
+
+RETRYABLE_CODES = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'RequestTimeout', 'InternalError', 'ServiceUnavailable',
+}
+MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '4'))
+BACKOFF_BASE = float(os.getenv('S3_BACKOFF_BASE_MS', '50')) / 1000
+BACKOFF_CAP = float(os.getenv('S3_BACKOFF_CAP_MS', '2000')) / 1000
+DEFAULT_DEADLINE = float(os.getenv('S3_DEADLINE_SECONDS', '10'))
+UPLOAD_DEADLINE = float(os.getenv('S3_UPLOAD_DEADLINE_SECONDS', '30'))
+# Managed copies are used for objects of unknown or large size, so they get a budget of their own
+COPY_DEADLINE = float(os.getenv('S3_COPY_DEADLINE_SECONDS', '300'))
+DEADLINES = {
+    'put_object': UPLOAD_DEADLINE,
+    'upload_fileobj': UPLOAD_DEADLINE,
+    'copy': COPY_DEADLINE,
+}
+# Hedging is off unless a delay is configured; it only applies to idempotent reads
+HEDGE_AFTER = float(os.getenv('S3_HEDGE_AFTER_MS', '0')) / 1000
+BREAKER_THRESHOLD = int(os.getenv('S3_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.getenv('S3_BREAKER_COOLDOWN_SECONDS', '30'))
+IDEMPOTENT_READS = {'get_object', 'head_object', 'list_objects_v2'}
+# Managed-transfer helpers boto3 adds to the client on top of the API operations
+TRANSFER_METHODS = {'upload_fileobj', 'upload_file', 'download_fileobj', 'download_file', 'copy'}
+
+
+class CircuitOpenError(ClientError):
+    def __init__(self, operation_name):
+        super().__init__(
+            {'Error': {'Code': 'CircuitOpen', 'Message': 'S3 circuit breaker is open'}},
+            operation_name
+        )
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` retryable failures with no successful response
+    in between. While open, calls
+    fail fast; once per `cooldown` a single probe is let through, and a
+    success closes the breaker again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Re-arm so only this caller probes during the next cooldown
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+# Attempts run here so the caller can stop waiting at the deadline; sized like the client's connection pool
+_attempt_pool = None
+_attempt_pool_lock = threading.Lock()
+
+
+def get_attempt_pool():
+    """Create the attempt pool lazily so each gunicorn worker gets its own after fork"""
+    global _attempt_pool
+    with _attempt_pool_lock:
+        if _attempt_pool is None:
+            _attempt_pool = ThreadPoolExecutor(max_workers=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '32')),
+                                               thread_name_prefix='s3-attempt')
+        return _attempt_pool
+
+
+def _forget_attempt_pool():
+    # The parent's pool threads do not exist in a forked child (gunicorn --preload)
+    global _attempt_pool, _attempt_pool_lock
+    _attempt_pool = None
+    _attempt_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_attempt_pool)
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return code in RETRYABLE_CODES or status >= 500
+    return isinstance(error, BotoCoreError)
+
+
+def _as_client_error(error, operation_name):
+    if isinstance(error, ClientError):
+        return error
+    return ClientError({'Error': {'Code': 'ServiceUnavailable', 'Message': str(error)}}, operation_name)
+
+
+def _deadline_error(operation_name):
+    return ClientError({'Error': {'Code': 'RequestTimeout', 'Message': 'Deadline exceeded'}}, operation_name)
+
+
+def call(operation_name, fn, idempotent=False, deadline=None):
+    """
+    Run fn() under the retry, deadline and breaker policies. Idempotent calls
+    are hedged with a duplicate request when HEDGE_AFTER is set.
+    """
+    deadline_at = time.monotonic() + (deadline or DEADLINES.get(operation_name, DEFAULT_DEADLINE))
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(operation_name)
+        try:
+            if idempotent and HEDGE_AFTER > 0:
+                result = _hedged(operation_name, fn, deadline_at)
+            else:
+                result = _bounded(operation_name, fn, deadline_at)
+        except (ClientError, BotoCoreError) as e:
+            if not is_retryable(e):
+                # S3 answered, but a 404 or AccessDenied is not evidence that it is healthy either
+                raise
+            breaker.record_failure()
+            attempt += 1
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            if attempt >= MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at:
+                raise _as_client_error(e, operation_name) from e
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+class ResilientClient:
+    """
+    Wraps a boto3 S3 client so every API call (and managed transfer) goes
+    through call(). Streams passed as Body/Fileobj are rewound before a retry.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._client.meta.method_to_api_mapping and name not in TRANSFER_METHODS:
+            return attr
+
+        def wrapped(*args, **kwargs):
+            rewind = _rewinder(args, kwargs)
+
+            def attempt():
+                rewind()
+                return attr(*args, **kwargs)
+
+            return call(name, attempt, idempotent=name in IDEMPOTENT_READS)
+
+        return wrapped
+
+
+def _rewinder(args, kwargs):
+    stream = kwargs.get('Body', kwargs.get('Fileobj', args[0] if args else None))
+    if not (hasattr(stream, 'seek') and hasattr(stream, 'tell')):
+        return lambda: None
+    position = stream.tell()
+    return lambda: stream.seek(position)
+
+
+def _bounded(operation_name, fn, deadline_at):
+    """
+    Run one attempt, giving up on it at the deadline. Socket timeouts apply
+    per read, so only this bounds a slow attempt; an abandoned one is
+    cancelled if it has not started, or finishes in the background with its
+    response discarded.
+    """
+    future = get_attempt_pool().submit(fn)
+    done, _ = wait([future], timeout=max(0, deadline_at - time.monotonic()))
+    if not done:
+        _abandon(future)
+        raise _deadline_error(operation_name)
+    return future.result()
+
+
+def _hedged(operation_name, fn, deadline_at):
+    """Send a duplicate request if the first has not answered within HEDGE_AFTER; first success wins"""
+    pool = get_attempt_pool()
+    first = pool.submit(fn)
+    done, _ = wait([first], timeout=max(0, min(HEDGE_AFTER, deadline_at - time.monotonic())))
+    if done:
+        return first.result()
+    pending = {first, pool.submit(fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline_at - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            for future in pending:
+                _abandon(future)
+            raise _deadline_error(operation_name)
+        winners = [future for future in done if future.exception() is None]
+        if winners:
+            for future in winners[1:]:
+                _discard(future)
+            for future in pending:
+                _abandon(future)
+            return winners[0].result()
+        error = done.pop().exception()
+    raise error
+
+
+def _abandon(future):
+    """Give up on an attempt: a queued one never runs, a running one has its response discarded"""
+    if not future.cancel():
+        future.add_done_callback(_discard)
+
+
+def _discard(future):
+    """Close the body of a response nobody will read, returning its connection to the pool"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    body = result.get('Body') if isinstance(result, dict) else None
+    if hasattr(body, 'close'):
+        body.close()
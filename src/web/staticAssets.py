@@ -0,0 +1,133 @@
+"""
+Response compression and content-hash fingerprinted static assets.
+
+At startup every file under the static folder is copied to a build directory
+as name.<hash>.ext together with pre-compressed .gz (and .br when the
+optional brotli package is installed) variants. url_for('static', ...) is
+rewritten to the fingerprinted name, which is served with an immutable,
+one-year Cache-Control and the best pre-compressed variant the client
+accepts, so nothing is compressed per request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+from flask import request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'text/html', 'text/css',
+    'text/plain', 'text/javascript', 'image/svg+xml',
+}
+# Below this, compression overhead outweighs the bytes saved
+MIN_COMPRESS_BYTES = 500
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build(static_folder, build_dir):
+    """
+    Fingerprint and pre-compress every static file; returns a manifest mapping
+    logical names (as passed to url_for) to fingerprinted names.
+    Content-addressed, so concurrent builds by several workers are harmless.
+    """
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, ext = os.path.splitext(logical)
+            fingerprinted = f"{stem}.{digest}{ext}"
+            target = os.path.join(build_dir, fingerprinted)
+            manifest[logical] = fingerprinted
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if mimetypes.guess_type(logical)[0] in COMPRESSIBLE_TYPES:
+                _write_atomic(target + '.gz', gzip.compress(data, compresslevel=9))
+                if brotli:
+                    _write_atomic(target + '.br', brotli.compress(data, quality=11))
+            _write_atomic(target, data)
+    return manifest
+
+
+def _accepted_encoding(available):
+    """Pick br or gzip from the client's Accept-Encoding, limited to what is available"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def init_app(app, build_dir=None):
+    build_dir = build_dir or os.getenv(
+        'STATIC_BUILD_DIR', os.path.join(tempfile.gettempdir(), 'image-hosting-static'))
+    manifest = build(app.static_folder, build_dir)
+    fingerprinted = set(manifest.values())
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def serve_static(filename):
+        if filename not in fingerprinted:
+            return send_from_directory(app.static_folder, filename)
+        path = os.path.join(build_dir, filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        available = [e for e, ext in (('br', '.br'), ('gzip', '.gz')) if os.path.exists(path + ext)]
+        encoding = _accepted_encoding(available)
+        if encoding:
+            path += '.br' if encoding == 'br' else '.gz'
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    app.view_functions['static'] = serve_static
+
+    @app.after_request
+    def compress_response(response):
+        return compress(response)
+
+    return manifest
+
+
+def compress(response):
+    """Compress JSON and text bodies on the fly; streamed and pre-encoded responses pass through"""
+    if (response.mimetype not in COMPRESSIBLE_TYPES
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
+    # Compressed or not, this body depends on Accept-Encoding, so shared caches must key on it
+    response.vary.add('Accept-Encoding')
+    encoding = _accepted_encoding(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=4))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    return response
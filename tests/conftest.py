@@ -0,0 +1,15 @@
+import pytest
+import src.app as app_module
+
+
+@pytest.fixture(autouse=True)
+def reset_admission_state():
+    """Rate-limit buckets live in a shared file, so clear them between tests"""
+    app_module.admission_control.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def no_background_gc(monkeypatch):
+    """Tests run collection passes explicitly instead of on the background thread"""
+    monkeypatch.setattr(app_module.imageCollector, "GC_INTERVAL", 0)
@@ -0,0 +1,103 @@
+import time
+from io import BytesIO
+import pytest
+import src.app as app_module
+from src.app import app
+from src.database import database
+from src.web.admission import AdmissionController
+
+@pytest.fixture
+def controller(tmp_path):
+    limits = {
+        'upload': {'rate': 0.001, 'burst': 5, 'concurrency': 2},
+        'list': {'rate': 0.001, 'burst': 2},
+    }
+    return AdmissionController(str(tmp_path / "admission.db"), limits, max_inflight=3)
+
+@pytest.fixture
+def client(controller, monkeypatch):
+    database.init_db()
+    monkeypatch.setattr(app_module, "admission_control", controller)
+    monkeypatch.setattr(app_module, "ADMISSION_CONTROL", True)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def test_token_bucket_rejects_after_burst(controller):
+    assert controller.admit('list', 'alice').allowed
+    assert controller.admit('list', 'alice').allowed
+    decision = controller.admit('list', 'alice')
+    assert not decision.allowed
+    assert decision.status == 429
+    assert decision.retry_after >= 1
+
+def test_buckets_are_per_user(controller):
+    controller.admit('list', 'alice')
+    controller.admit('list', 'alice')
+    assert controller.admit('list', 'bob').allowed
+
+def test_tokens_refill_over_time(tmp_path):
+    controller = AdmissionController(str(tmp_path / "a.db"), {'list': {'rate': 1000, 'burst': 1}})
+    assert controller.admit('list', 'alice').allowed
+    time.sleep(0.01)
+    assert controller.admit('list', 'alice').allowed
+
+def test_concurrent_upload_cap_and_release(controller):
+    first = controller.admit('upload', 'alice')
+    second = controller.admit('upload', 'alice')
+    third = controller.admit('upload', 'alice')
+    assert first.allowed and second.allowed
+    assert not third.allowed and third.reason == 'too_many_concurrent'
+    controller.release(first.slots)
+    assert controller.admit('upload', 'alice').allowed
+
+def test_concurrency_rejection_keeps_tokens(tmp_path):
+    controller = AdmissionController(str(tmp_path / "a.db"),
+                                     {'upload': {'rate': 0.001, 'burst': 2, 'concurrency': 1}})
+    first = controller.admit('upload', 'alice')
+    for _ in range(3):
+        assert controller.admit('upload', 'alice').reason == 'too_many_concurrent'
+    controller.release(first.slots)
+    assert controller.admit('upload', 'alice').allowed
+
+def test_global_inflight_cap_sheds_load(controller):
+    decisions = [controller.admit('upload', f'user{i}') for i in range(3)]
+    assert all(d.allowed for d in decisions)
+    shed = controller.admit('upload', 'user9')
+    assert shed.status == 503
+    assert controller.get_counters() == {'rejected.upload.overloaded': 1}
+
+def test_listing_route_returns_429_with_retry_after(client):
+    for _ in range(2):
+        assert client.get('/api/images?username=carol').status_code == 200
+    response = client.get('/api/images?username=carol')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert client.get('/api/metrics').json['admission'] == {'rejected.list.rate_limited': 1}
+
+def test_slots_released_after_request(client, controller):
+    for i in range(5):
+        client.get(f'/api/categories?username=user{i}')
+    assert controller.admit('upload', 'dave').allowed
+
+def test_unlimited_routes_are_not_counted(client):
+    for _ in range(5):
+        assert client.get('/gallery').status_code == 200
+
+def test_upload_user_comes_from_header_or_address(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module.admission_control, "admit",
+                        lambda route_class, username: calls.append(username) or
+                        app_module.admission.Decision(False, 429, 'rate_limited', retry_after=1))
+    response = client.post('/api/upload', headers={'X-Username': 'erin'},
+                           data={'username': 'erin', 'file': (BytesIO(b'x'), 'a.png')})
+    assert response.status_code == 429
+    client.post('/api/upload', data={'username': 'ignored', 'file': (BytesIO(b'x'), 'a.png')})
+    assert calls == ['erin', 'addr:127.0.0.1']
+
+def test_upload_header_must_match_username(client, monkeypatch):
+    monkeypatch.setattr(app_module.storageAws, "upload_image_with_metadata",
+                        lambda *args: pytest.fail("a mismatched upload must not reach S3"))
+    response = client.post('/api/upload', headers={'X-Username': 'mallory'},
+                           data={'username': 'bob', 'file': (BytesIO(b'x'), 'a.png')})
+    assert response.status_code == 400
@@ -1,9 +1,14 @@
 import pytest
+import json
+import boto3
 from io import BytesIO
+from moto import mock_aws
+from PIL import Image
 import sys
 from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root / "src"))
+import src.app as app_module
 from src.app import app
 from src.database import database
 
@@ -98,4 +103,108 @@ def test_create_category_missing_fields(client):
 
 def test_nonexistent_route(client):
     response = client.get('/fake_route')
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        yield "test-bucket"
+
+def _png_upload(name, width=32, height=16):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (0, 120, 200)).save(buffer, format="PNG")
+    buffer.seek(0)
+    return (buffer, name)
+
+def test_upload_stores_metadata(client, s3_bucket):
+    response = client.post('/api/upload', data={
+        'username': 'frank', 'category': 'photos', 'file': _png_upload('pic.png')
+    })
+    assert response.status_code == 200
+    response = client.get('/api/images?username=frank&details=1')
+    assert response.status_code == 200
+    [image] = response.json
+    assert image['url'].endswith('/frank/photos/pic.png')
+    assert image['content_type'] == 'image/png'
+    assert (image['width'], image['height']) == (32, 16)
+    assert image['size_bytes'] > 0
+    assert image['etag']
+    assert image['placeholder'] == '#0078c8'
+
+def test_get_images_without_details_returns_urls(client, s3_bucket):
+    client.post('/api/upload', data={'username': 'gina', 'file': _png_upload('a.png')})
+    response = client.get('/api/images?username=gina')
+    assert response.json == ['https://test-bucket.s3.amazonaws.com/gina/uncategorized/a.png']
+
+def test_export_streams_ndjson_with_filters(client):
+    base = 'https://test-bucket.s3.amazonaws.com/hana'
+    database.add_image('hana', f'{base}/photos/old.png')
+    database.add_image('hana', f'{base}/photos/new.png', {'width': 10, 'height': 20})
+    database.add_image('hana', f'{base}/designs/logo.png')
+    conn = database.get_db_connection()
+    conn.execute("UPDATE images SET created_at = '2024-01-01 00:00:00' WHERE image_url LIKE '%old.png'")
+    conn.commit()
+    conn.close()
+
+    response = client.get('/api/images/export?username=hana&category=photos&since=2025-01-01')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['url'] for line in lines] == [f'{base}/photos/new.png']
+    assert lines[0]['width'] == 10
+
+    response = client.get('/api/images/export?username=hana&until=2025-01-01')
+    assert len(response.data.decode().splitlines()) == 1
+
+def test_export_category_matches_only_the_category_segment(client):
+    def add(key):
+        database.add_image('ab', f'https://test-bucket.s3.amazonaws.com/{key}',
+                           {'bucket': 'test-bucket', 's3_key': key})
+
+    add('ab/trips/a.png')
+    add('ab/ab/b.png')
+    add('3f/ab/trips/c.png')
+    add('ab/cats/d.png')
+
+    def exported(category):
+        response = client.get(f'/api/images/export?username=ab&category={category}')
+        return sorted(json.loads(line)['url'].rsplit('/', 1)[1] for line in response.data.decode().splitlines())
+
+    # The username and a hash prefix both look like an 'ab' segment
+    assert exported('ab') == ['b.png']
+    assert exported('trips') == ['a.png', 'c.png']
+
+def test_export_converts_offsets_to_utc(client):
+    database.add_image('hana', 'https://test-bucket.s3.amazonaws.com/hana/photos/a.png')
+    conn = database.get_db_connection()
+    conn.execute("UPDATE images SET created_at = '2025-01-01 00:30:00'")
+    conn.commit()
+    conn.close()
+    # 02:00+02:00 is midnight UTC, so the image is after it; 03:00+02:00 is after the image
+    response = client.get('/api/images/export?username=hana&since=2025-01-01T02:00:00%2B02:00')
+    assert len(response.data.decode().splitlines()) == 1
+    response = client.get('/api/images/export?username=hana&since=2025-01-01T03:00:00%2B02:00')
+    assert response.data == b''
+
+def test_export_pages_without_holding_the_database(client):
+    for i in range(5):
+        database.add_image('hana', f'https://test-bucket.s3.amazonaws.com/hana/photos/{i}.png')
+    rows = database.iter_image_details('hana', batch_size=2)
+    first = next(rows)
+    # A writer that does not wait must still get in while the export is mid-stream
+    conn = database.sqlite3.connect(database.shard_path(0), timeout=0)
+    conn.execute("UPDATE images SET width = 1")
+    conn.commit()
+    conn.close()
+    urls = [first['url'], *(row['url'] for row in rows)]
+    assert sorted(urls) == sorted(f'https://test-bucket.s3.amazonaws.com/hana/photos/{i}.png' for i in range(5))
+
+def test_export_rejects_bad_dates(client):
+    response = client.get('/api/images/export?username=hana&since=yesterday')
+    assert response.status_code == 400
+
+def test_export_requires_username(client):
+    response = client.get('/api/images/export')
+    assert response.status_code == 400
@@ -0,0 +1,107 @@
+import boto3
+import pytest
+from io import BytesIO
+from moto import mock_aws
+import src.app as app_module
+from src.app import app
+from src.database import database
+from src.database import storageAws
+
+BUCKET = "test-bucket"
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def reset_database():
+    database.init_db()
+    yield
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(app_module, "BUCKET_NAME", BUCKET)
+        yield s3
+
+def upload(client, category, name, username='kim'):
+    data = {'username': username, 'category': category, 'file': (BytesIO(name.encode()), name)}
+    assert client.post('/api/upload', data=data).status_code == 200
+
+def keys(s3, prefix):
+    return sorted(o['Key'] for o in s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix).get('Contents', []))
+
+def test_rename_moves_objects_rows_and_category(client, s3):
+    client.post('/api/categories', json={'username': 'kim', 'category_name': 'trips'})
+    for i in range(5):
+        upload(client, 'trips', f'{i}.png')
+    response = client.post('/api/categories/rename',
+                           json={'username': 'kim', 'category_name': 'trips', 'new_name': 'travel'})
+    assert response.status_code == 200
+    assert response.json['moved'] == 5
+    assert keys(s3, 'kim/trips/') == []
+    assert keys(s3, 'kim/travel/') == [f'kim/travel/{i}.png' for i in range(5)]
+    urls = client.get('/api/images?username=kim&category=travel').json
+    assert len(urls) == 5
+    assert s3.get_object(Bucket=BUCKET, Key='kim/travel/3.png')['Body'].read() == b'3.png'
+    names = [c['name'] for c in client.get('/api/categories?username=kim').json]
+    assert names == ['travel']
+
+def test_rename_to_existing_category_fails(client, s3):
+    upload(client, 'a', 'x.png')
+    client.post('/api/categories', json={'username': 'kim', 'category_name': 'b'})
+    response = client.post('/api/categories/rename',
+                           json={'username': 'kim', 'category_name': 'a', 'new_name': 'b'})
+    assert response.status_code == 400
+    assert keys(s3, 'kim/a/') == ['kim/a/x.png']
+
+def test_merge_combines_categories(client, s3):
+    upload(client, 'a', 'one.png')
+    upload(client, 'b', 'two.png')
+    response = client.post('/api/categories/merge',
+                           json={'username': 'kim', 'category_name': 'a', 'target': 'b'})
+    assert response.status_code == 200
+    assert keys(s3, 'kim/') == ['kim/b/one.png', 'kim/b/two.png']
+    assert len(client.get('/api/images?username=kim&category=b').json) == 2
+
+def test_merge_with_name_conflict_is_rejected(client, s3):
+    upload(client, 'a', 'same.png')
+    upload(client, 'b', 'same.png')
+    response = client.post('/api/categories/merge',
+                           json={'username': 'kim', 'category_name': 'a', 'target': 'b'})
+    assert response.status_code == 400
+    assert response.json['conflicts'] == ['same.png']
+
+def test_interrupted_rename_resumes(client, s3, monkeypatch):
+    for i in range(3):
+        upload(client, 'old', f'{i}.png')
+    real_copy = storageAws.copy_images
+
+    def flaky_copy(copies, max_workers=16):
+        real_copy(copies[:1], max_workers)
+        return copies[1:]
+
+    monkeypatch.setattr(app_module.categoryMoves.storageAws, "copy_images", flaky_copy)
+    body = {'username': 'kim', 'category_name': 'old', 'new_name': 'new'}
+    response = client.post('/api/categories/rename', json=body)
+    assert response.status_code == 500
+    assert response.json['retryable']
+    assert len(client.get('/api/images?username=kim&category=old').json) == 3
+
+    copied = []
+    monkeypatch.setattr(app_module.categoryMoves.storageAws, "copy_images",
+                        lambda copies, max_workers=16: copied.extend(copies) or real_copy(copies))
+    response = client.post('/api/categories/rename', json=body)
+    assert response.status_code == 200
+    assert len(copied) == 2
+    assert keys(s3, 'kim/') == [f'kim/new/{i}.png' for i in range(3)]
+
+def test_rename_missing_category(client, s3):
+    client.get('/auth?username=kim&password=pw')
+    response = client.post('/api/categories/rename',
+                           json={'username': 'kim', 'category_name': 'nope', 'new_name': 'x'})
+    assert response.status_code == 400
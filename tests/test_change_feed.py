@@ -0,0 +1,188 @@
+import time
+import boto3
+from io import BytesIO
+import pytest
+from moto import mock_aws
+import src.app as app_module
+from src.app import app
+from src.database import database
+from src.database import reshard
+
+URL = 'https://test-bucket.s3.amazonaws.com/ivy/cats/{}'
+IMAGE = {'username': 'ivy', 'category': 'cats', 'image_name': 'tom.png'}
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def s3(monkeypatch):
+    database.init_db()
+    app_module.database.clear_user_id_cache()
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "admin-token")
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        yield s3
+
+def upload(client, name, username='ivy', category='cats'):
+    data = {'username': username, 'category': category, 'file': (BytesIO(b'img'), name)}
+    assert client.post('/api/upload', data=data).status_code == 200
+
+def changes(client, since=0, **params):
+    query = '&'.join(f'{k}={v}' for k, v in {'username': 'ivy', 'since': since, **params}.items())
+    response = client.get(f'/api/changes?{query}')
+    assert response.status_code == 200
+    return response.json
+
+def ops(feed):
+    return [(c['kind'], c['op'], c['item']) for c in feed['changes']]
+
+def test_writes_are_logged_in_order(client, s3):
+    client.post('/api/categories', json={'username': 'ivy', 'category_name': 'cats'})
+    upload(client, 'tom.png')
+    client.delete('/api/images/delete', json=IMAGE)
+    client.post('/api/images/restore', json=IMAGE)
+    upload(client, 'jerry.png', username='bob')
+    feed = changes(client)
+    assert ops(feed) == [
+        ('category', 'insert', 'cats'),
+        ('image', 'insert', URL.format('tom.png')),
+        ('image', 'delete', URL.format('tom.png')),
+        ('image', 'insert', URL.format('tom.png')),
+    ]
+    assert [c['seq'] for c in feed['changes']] == sorted(c['seq'] for c in feed['changes'])
+    assert not feed['reset'] and not feed['has_more']
+    # bob's upload is past ivy's last change, and next skips over it
+    assert feed['next'] > feed['changes'][-1]['seq']
+    assert changes(client, feed['next'])['changes'] == []
+
+def test_pagination(client, s3):
+    for i in range(5):
+        upload(client, f'{i}.png')
+    first = changes(client, limit=4)
+    assert len(first['changes']) == 4 and first['has_more']
+    assert first['next'] == first['changes'][-1]['seq']
+    rest = changes(client, first['next'], limit=4)
+    assert ops(rest) == [('image', 'insert', URL.format('4.png'))]
+    assert not rest['has_more']
+
+def test_rename_logs_deletes_and_inserts(client, s3):
+    client.post('/api/categories', json={'username': 'ivy', 'category_name': 'cats'})
+    upload(client, 'tom.png')
+    since = changes(client)['next']
+    response = client.post('/api/categories/rename',
+                           json={'username': 'ivy', 'category_name': 'cats', 'new_name': 'pets'})
+    assert response.status_code == 200
+    assert sorted(ops(changes(client, since))) == [
+        ('category', 'delete', 'cats'),
+        ('category', 'insert', 'pets'),
+        ('image', 'delete', URL.format('tom.png')),
+        ('image', 'insert', 'https://test-bucket.s3.amazonaws.com/ivy/pets/tom.png'),
+    ]
+
+def test_compaction_drops_superseded_entries(client, s3):
+    upload(client, 'tom.png')
+    client.delete('/api/images/delete', json=IMAGE)
+    client.post('/api/images/restore', json=IMAGE)
+    response = client.post('/admin/changes/compact', headers={'Authorization': 'Bearer admin-token'})
+    assert response.json == {'removed': 2}
+    feed = changes(client)
+    assert ops(feed) == [('image', 'insert', URL.format('tom.png'))]
+    assert not feed['reset']
+
+def test_expired_entries_force_a_reset(client, s3):
+    upload(client, 'tom.png')
+    stale = changes(client)['next']
+    conn = database.get_db_connection()
+    conn.execute("UPDATE changes SET created_at = datetime('now', '-2 days')")
+    conn.commit()
+    conn.close()
+    upload(client, 'jerry.png')
+    assert database.compact_changes(retention_seconds=86400) == 1
+    assert changes(client)['reset']
+    feed = changes(client, stale)
+    assert ops(feed) == [('image', 'insert', URL.format('jerry.png'))]
+
+def test_since_beyond_log_resets(client, s3):
+    upload(client, 'tom.png')
+    feed = changes(client, 10**6)
+    assert feed['reset'] and feed['changes'] == []
+    assert changes(client, feed['next'])['changes'] == []
+
+def test_bad_parameters(client, s3):
+    assert client.get('/api/changes?username=ivy&since=-1').status_code == 400
+    assert client.get('/api/changes?username=ivy&since=abc').status_code == 400
+    assert client.get('/api/changes?username=ivy&limit=0').status_code == 400
+    assert client.get('/api/changes?since=0').status_code == 400
+
+def test_reshard_resets_sync_clients(client, s3, tmp_path, monkeypatch):
+    for module in (database, app_module.database):
+        monkeypatch.setattr(module, "DB_NAME", str(tmp_path / "images.db"))
+        monkeypatch.setattr(module, "_writers", {})
+    database.init_db()
+    app_module.database.clear_user_id_cache()
+    upload(client, 'tom.png')
+    since = changes(client)['next']
+    reshard.reshard(1, 2)
+    for module in (database, app_module.database):
+        monkeypatch.setattr(module, "DB_SHARDS", 2)
+    app_module.database.clear_user_id_cache()
+    # A client that had seen everything carries on; one that had not re-lists
+    assert not changes(client, since)['reset']
+    feed = changes(client, since - 1)
+    assert feed['reset'] and feed['next'] == since
+    upload(client, 'jerry.png')
+    assert ops(changes(client, since)) == [('image', 'insert', URL.format('jerry.png'))]
+
+def test_compaction_in_small_batches(client, s3, monkeypatch):
+    monkeypatch.setattr(app_module.database, "CHANGE_LOG_COMPACT_BATCH", 2)
+    for name in ('tom.png', 'jerry.png'):
+        upload(client, name)
+        client.delete('/api/images/delete', json={**IMAGE, 'image_name': name})
+        client.post('/api/images/restore', json={**IMAGE, 'image_name': name})
+    response = client.post('/admin/changes/compact', headers={'Authorization': 'Bearer admin-token'})
+    assert response.json == {'removed': 4}
+    assert ops(changes(client)) == [('image', 'insert', URL.format('tom.png')),
+                                    ('image', 'insert', URL.format('jerry.png'))]
+
+def test_upgraded_database_resets_clients(client, s3):
+    upload(client, 'tom.png')
+    # The shard as it was before the change log existed
+    conn = database.get_db_connection()
+    conn.executescript('''
+        DROP TABLE changes;
+        DROP TABLE change_log_state;
+        DELETE FROM sqlite_sequence WHERE name = 'changes';
+    ''')
+    conn.close()
+    database.migrate_db()
+    feed = changes(client)
+    assert feed['reset'] and feed['changes'] == []
+    upload(client, 'jerry.png')
+    assert ops(changes(client, feed['next'])) == [('image', 'insert', URL.format('jerry.png'))]
+    # Migrating again, or a fresh database, does not move the log
+    database.migrate_db()
+    assert not changes(client, feed['next'])['reset']
+
+def test_fresh_database_does_not_reset(client, s3):
+    database.migrate_db()
+    assert not changes(client)['reset']
+
+def test_collector_compacts_on_first_pass(s3, monkeypatch):
+    collector = app_module.imageCollector
+    compacted = []
+    monkeypatch.setattr(collector, "GC_INTERVAL", 0.01)
+    monkeypatch.setattr(collector.database, "compact_changes", lambda: compacted.append(True))
+    collector.ensure_started()
+    try:
+        for _ in range(200):
+            if compacted:
+                break
+            time.sleep(0.01)
+    finally:
+        collector.stop()
+    assert len(compacted) == 1
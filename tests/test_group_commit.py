@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+import pytest
+from src.database import database
+from src.database.groupCommit import GroupCommitWriter
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    database.init_db()
+    return path
+
+@pytest.fixture
+def writer(db_path):
+    writer = GroupCommitWriter(database.get_db_connection, max_delay=0.05, max_batch=100)
+    yield writer
+    writer.close()
+
+def _insert(conn, url):
+    return conn.execute("INSERT INTO images (user_id, image_url) VALUES (1, ?)", (url,)).lastrowid
+
+def test_concurrent_writes_share_a_transaction(writer, db_path):
+    barrier = threading.Barrier(20)
+    futures = []
+
+    def submit(i):
+        barrier.wait()
+        futures.append(writer.submit(_insert, f"url{i}"))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ids = sorted(f.result(timeout=5) for f in futures)
+    assert ids == list(range(1, 21))
+    assert writer.batches_committed < 20
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 20
+    conn.close()
+
+def test_failing_operation_only_fails_its_own_future(writer):
+    good = writer.submit(_insert, "good")
+    bad = writer.submit(_insert, None)  # violates NOT NULL
+    assert good.result(timeout=5) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result(timeout=5)
+
+def test_max_batch_splits_batches(db_path):
+    writer = GroupCommitWriter(database.get_db_connection, max_delay=0.5, max_batch=2)
+    futures = [writer.submit(_insert, f"url{i}") for i in range(4)]
+    assert [f.result(timeout=5) for f in futures] == [1, 2, 3, 4]
+    assert writer.batches_committed == 2
+    writer.close()
+
+def test_add_image_through_group_commit(db_path, monkeypatch):
+    monkeypatch.setattr(database, "GROUP_COMMIT", True)
+    monkeypatch.setattr(database, "_writers", {})
+    image_id = database.add_image("alice", "https://bucket/alice/a.png")
+    assert image_id == 1
+    assert database.get_images_by_username("alice") == ["https://bucket/alice/a.png"]
+    assert database.delete_image_by_username("alice", "https://bucket/alice/a.png")
+    database.get_writer().close()
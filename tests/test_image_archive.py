@@ -0,0 +1,94 @@
+import zipfile
+import boto3
+import pytest
+from io import BytesIO
+from moto import mock_aws
+import src.app as app_module
+from src.app import app
+from src.database import database
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def s3(monkeypatch):
+    database.init_db()
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        yield s3
+
+def upload(client, category, name, data):
+    body = {'username': 'max', 'category': category, 'file': (BytesIO(data), name)}
+    assert client.post('/api/upload', data=body).status_code == 200
+
+def read_zip(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    return zipfile.ZipFile(BytesIO(response.get_data()))
+
+def test_archive_of_category(client, s3):
+    for i in range(10):
+        upload(client, 'trips', f'{i}.png', f'image {i}'.encode() * 100)
+    upload(client, 'other', 'x.png', b'other')
+    response = client.get('/api/images/archive?username=max&category=trips')
+    assert 'max-trips.zip' in response.headers['Content-Disposition']
+    archive = read_zip(response)
+    assert sorted(archive.namelist()) == sorted(f'{i}.png' for i in range(10))
+    assert archive.read('3.png') == b'image 3' * 100
+    assert archive.testzip() is None
+
+def test_archive_of_whole_library(client, s3):
+    upload(client, 'a', 'one.png', b'1')
+    upload(client, 'b', 'one.png', b'2')
+    archive = read_zip(client.get('/api/images/archive?username=max'))
+    assert sorted(archive.namelist()) == ['a/one.png', 'b/one.png']
+    assert archive.read('b/one.png') == b'2'
+
+def test_large_objects_are_streamed_in_chunks(client, s3, monkeypatch):
+    archive_module = app_module.imageArchive
+    monkeypatch.setattr(archive_module, "ARCHIVE_PREFETCH_MAX_BYTES", 1024)
+    monkeypatch.setattr(archive_module, "CHUNK_SIZE", 4096)
+    big = bytes(range(256)) * 200
+    upload(client, 'raw', 'big.png', big)
+    upload(client, 'raw', 'small.png', b'tiny')
+    response = client.get('/api/images/archive?username=max&category=raw', buffered=False)
+    chunks = list(response.response)
+    assert len(chunks) > 5
+    assert max(len(chunk) for chunk in chunks) < len(big)
+    archive = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+    assert archive.read('big.png') == big
+    assert archive.read('small.png') == b'tiny'
+
+def test_listing_is_read_before_streaming(client, s3, monkeypatch):
+    monkeypatch.setattr(app_module.imageArchive, "ARCHIVE_PREFETCH", 1)
+    upload(client, 'trips', 'a.png', b'a')
+    upload(client, 'trips', 'b.png', b'b')
+    listed = []
+    iter_image_details = app_module.database.iter_image_details
+
+    def tracked(*args, **kwargs):
+        yield from iter_image_details(*args, **kwargs)
+        listed.append(True)
+
+    monkeypatch.setattr(app_module.database, "iter_image_details", tracked)
+    response = client.get('/api/images/archive?username=max&category=trips', buffered=False)
+    # The listing is finished before the first byte of the archive is sent
+    assert listed
+    archive = zipfile.ZipFile(BytesIO(b''.join(response.response)))
+    assert sorted(archive.namelist()) == ['a.png', 'b.png']
+
+def test_unreadable_objects_are_listed(client, s3):
+    upload(client, 'trips', 'kept.png', b'kept')
+    upload(client, 'trips', 'gone.png', b'gone')
+    s3.delete_object(Bucket='test-bucket', Key='max/trips/gone.png')
+    archive = read_zip(client.get('/api/images/archive?username=max&category=trips'))
+    assert sorted(archive.namelist()) == ['MISSING.txt', 'kept.png']
+    assert 'gone.png' in archive.read('MISSING.txt').decode()
+
+def test_archive_requires_username(client):
+    assert client.get('/api/images/archive').status_code == 400
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import boto3
+import pytest
+from io import BytesIO
+from moto import mock_aws
+from PIL import Image
+import src.app as app_module
+from src.app import app
+from src.database import database
+from src.database.storageDiskCache import DiskCache
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def reset_database():
+    database.init_db()
+    yield
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+    monkeypatch.setattr(app_module, "image_cache", cache)
+    return cache
+
+@pytest.fixture
+def uploaded(client, monkeypatch):
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        buffer = BytesIO()
+        Image.new("RGB", (400, 200), (10, 200, 30)).save(buffer, format="JPEG")
+        buffer.seek(0)
+        client.post('/api/upload', data={'username': 'ivy', 'category': 'photos', 'file': (buffer, 'big.jpg')})
+        yield '/img/ivy/photos/big.jpg'
+
+def test_resize_keeps_aspect_ratio(client, cache, uploaded):
+    response = client.get(uploaded + '?w=100')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert Image.open(BytesIO(response.data)).size == (100, 50)
+
+def test_negotiates_webp_from_accept(client, cache, uploaded):
+    response = client.get(uploaded + '?w=50', headers={'Accept': 'image/webp,*/*'})
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+    assert Image.open(BytesIO(response.data)).format == 'WEBP'
+
+def test_wildcard_accept_keeps_original_format(client, cache, uploaded):
+    response = client.get(uploaded + '?w=50', headers={'Accept': '*/*'})
+    assert response.mimetype == 'image/jpeg'
+
+def test_etag_and_range(client, cache, uploaded):
+    first = client.get(uploaded + '?w=80')
+    etag = first.headers['ETag']
+    assert client.get(uploaded + '?w=80', headers={'If-None-Match': etag}).status_code == 304
+    partial = client.get(uploaded + '?w=80', headers={'Range': 'bytes=0-9'})
+    assert partial.status_code == 206
+    assert partial.data == first.data[:10]
+
+def test_variants_are_served_from_cache(client, cache, uploaded, monkeypatch):
+    client.get(uploaded + '?w=60')
+    monkeypatch.setattr(app_module.storageAws, "get_image", lambda *args: pytest.fail("S3 fetched again"))
+    assert client.get(uploaded + '?w=60').status_code == 200
+
+def test_unknown_image_and_bad_params(client, cache, uploaded):
+    assert client.get('/img/ivy/photos/missing.jpg').status_code == 404
+    assert client.get(uploaded + '?w=0').status_code == 400
+    assert client.get(uploaded + '?q=101').status_code == 400
+
+def test_undecodable_object_is_422(client, cache, uploaded):
+    client.post('/api/upload', data={'username': 'ivy', 'category': 'photos',
+                                     'file': (BytesIO(b'not an image'), 'fake.png')})
+    assert client.get('/img/ivy/photos/fake.png?w=50').status_code == 422
+
+def test_variant_evicted_before_open_is_rebuilt(client, cache, uploaded, monkeypatch):
+    get_or_create = cache.get_or_create
+    evicted = []
+
+    def evict_first(key, produce):
+        path = get_or_create(key, produce)
+        if not evicted:
+            evicted.append(path)
+            os.remove(path)
+        return path
+
+    monkeypatch.setattr(cache, "get_or_create", evict_first)
+    response = client.get(uploaded + '?w=40')
+    assert response.status_code == 200
+    assert Image.open(BytesIO(response.data)).size == (40, 20)
+    assert evicted
+
+def test_concurrent_misses_produce_once(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 * 1024)
+    calls = []
+
+    def produce():
+        calls.append(1)
+        time.sleep(0.1)
+        return b"variant"
+
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.get_or_create("k", produce))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(set(paths)) == 1
+
+def test_concurrent_misses_share_the_producer_error(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 * 1024)
+    calls = []
+
+    def produce():
+        calls.append(1)
+        time.sleep(0.1)
+        raise app_module.imageProcessing.UnsupportedImage("not an image")
+
+    errors = []
+
+    def fetch():
+        try:
+            cache.get_or_create("k", produce)
+        except app_module.imageProcessing.UnsupportedImage as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(errors) == 8
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 250)
+    old = cache.put("old", b"x" * 100)
+    os.utime(old, (0, 0))
+    cache.put("recent", b"x" * 100)
+    cache.put("newest", b"x" * 100)
+    assert cache.get("old") is None
+    assert cache.get("recent") and cache.get("newest")
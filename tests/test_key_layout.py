@@ -0,0 +1,116 @@
+import hashlib
+import boto3
+import pytest
+from io import BytesIO
+from moto import mock_aws
+from PIL import Image
+import src.app as app_module
+from src.app import app
+from src.database import database
+from database import keyMigration
+
+BUCKETS = ["bucket-a", "bucket-b"]
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def s3(monkeypatch):
+    database.init_db()
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        for bucket in BUCKETS:
+            s3.create_bucket(Bucket=bucket)
+        monkeypatch.setattr(app_module, "BUCKET_NAME", BUCKETS[0])
+        yield s3
+
+@pytest.fixture
+def hashed(monkeypatch):
+    layout = app_module.keyLayout
+    monkeypatch.setattr(layout, "KEY_LAYOUT", "hashed")
+    monkeypatch.setattr(layout, "S3_BUCKETS", BUCKETS)
+    return layout
+
+def upload(client, category, name, username='lee'):
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, format="PNG")
+    buffer.seek(0)
+    data = {'username': username, 'category': category, 'file': (buffer, name)}
+    assert client.post('/api/upload', data=data).status_code == 200
+
+def objects(s3):
+    return sorted((bucket, obj['Key']) for bucket in BUCKETS
+                  for obj in s3.list_objects_v2(Bucket=bucket).get('Contents', []))
+
+def test_parse_and_locate():
+    layout = app_module.keyLayout
+    assert layout.parse("lee/cats/a.png") == ("lee", "cats", "a.png")
+    hashed_key = f"{hashlib.sha256(b'lee/cats/a.png').hexdigest()[:2]}/lee/cats/a.png"
+    assert layout.parse(hashed_key) == ("lee", "cats", "a.png")
+    assert layout.parse("lee/a.png") is None
+    # A flat key whose user is a hex word is not mistaken for a hashed one
+    assert layout.parse("cafe/a/b/c.png") is None
+    assert layout.locate(BUCKETS, "lee", "cats", "a.png") == ("bucket-a", "lee/cats/a.png")
+
+def test_hashed_layout_spreads_prefixes_and_buckets(hashed):
+    locations = [hashed.locate(BUCKETS, "lee", "cats", f"{i}.png") for i in range(200)]
+    assert len({key.split('/')[0] for _, key in locations}) > 100
+    assert {bucket for bucket, _ in locations} == set(BUCKETS)
+    assert locations == [hashed.locate(BUCKETS, "lee", "cats", f"{i}.png") for i in range(200)]
+    assert all(hashed.parse(key)[2] == f"{i}.png" for i, (_, key) in enumerate(locations))
+
+def test_hashed_upload_list_view_and_delete(client, s3, hashed):
+    upload(client, 'cats', 'tom.png')
+    [(bucket, key)] = objects(s3)
+    assert key.endswith('/lee/cats/tom.png') and len(key.split('/')) == 4
+    assert client.get('/api/images?username=lee&category=cats').json == [
+        f"https://{bucket}.s3.amazonaws.com/{key}"]
+    assert client.get('/img/lee/cats/tom.png').status_code == 200
+    body = {'username': 'lee', 'category': 'cats', 'image_name': 'tom.png'}
+    assert client.delete('/api/images/delete', json=body).status_code == 200
+
+def test_hashed_rename_moves_between_buckets(client, s3, hashed):
+    for i in range(6):
+        upload(client, 'old', f'{i}.png')
+    response = client.post('/api/categories/rename',
+                           json={'username': 'lee', 'category_name': 'old', 'new_name': 'new'})
+    assert response.status_code == 200
+    expected = sorted(hashed.locate(BUCKETS, 'lee', 'new', f'{i}.png') for i in range(6))
+    assert objects(s3) == expected
+
+def test_flat_objects_in_bucket_name_stay_reachable(client, s3, monkeypatch):
+    upload(client, 'pets', 'rex.png')
+    # S3_BUCKETS set later without BUCKET_NAME first
+    monkeypatch.setattr(app_module.keyLayout, "S3_BUCKETS", ["bucket-b", "bucket-a"])
+    assert client.get('/img/lee/pets/rex.png').status_code == 200
+    body = {'username': 'lee', 'category': 'pets', 'image_name': 'rex.png'}
+    assert client.delete('/api/images/delete', json=body).status_code == 200
+
+def test_migration_moves_flat_objects(client, s3, monkeypatch):
+    for i in range(5):
+        upload(client, 'pets', f'{i}.png')
+    client.delete('/api/images/delete', json={'username': 'lee', 'category': 'pets', 'image_name': '4.png'})
+    layout = app_module.keyLayout
+    monkeypatch.setattr(layout, "KEY_LAYOUT", "hashed")
+    monkeypatch.setattr(layout, "S3_BUCKETS", BUCKETS)
+    # Old images stay reachable before the migration runs
+    assert client.get('/img/lee/pets/0.png').status_code == 200
+    assert keyMigration.migrate(BUCKETS, dry_run=True)['moved'] == 5
+    assert keyMigration.migrate(BUCKETS) == {'moved': 5, 'failed': 0, 'skipped': 0}
+    assert objects(s3) == sorted(layout.locate(BUCKETS, 'lee', 'pets', f'{i}.png') for i in range(5))
+    assert client.get('/img/lee/pets/1.png').status_code == 200
+    restore = {'username': 'lee', 'category': 'pets', 'image_name': '4.png'}
+    assert client.post('/api/images/restore', json=restore).status_code == 200
+    assert keyMigration.migrate(BUCKETS)['moved'] == 0
+
+def test_migrate_db_backfills_locations():
+    database.init_db()
+    database.add_image('lee', 'https://bucket-a.s3.amazonaws.com/lee/cats/a.png')
+    database.migrate_db()
+    conn = database.get_db_connection()
+    row = conn.execute("SELECT bucket, s3_key FROM images").fetchone()
+    conn.close()
+    assert (row['bucket'], row['s3_key']) == ('bucket-a', 'lee/cats/a.png')
@@ -0,0 +1,78 @@
+import pstats
+import time
+import pytest
+import src.app as app_module
+from src.app import app
+from src.database import database
+
+ADMIN = {'Authorization': 'Bearer admin-token'}
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def profiling(tmp_path, monkeypatch):
+    database.init_db()
+    profiler = app_module.profiler
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiler, "PROFILE_SECRET", "secret")
+    monkeypatch.setattr(profiler, "PROFILE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(profiler, "PROFILE_INTERVAL_MS", 1)
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "admin-token")
+    return profiler
+
+def test_unprofiled_requests_write_nothing(client, profiling):
+    client.get('/api/images?username=mia')
+    assert profiling.list_captures() == []
+
+def test_signed_header_captures_request(client, profiling):
+    token = profiling.sign(int(time.time()) + 60)
+    client.get('/api/images?username=mia', headers={'X-Profile': token})
+    [capture] = client.get('/admin/profiles', headers=ADMIN).json
+    assert capture['route'] == '/api/images'
+    assert capture['user'] == 'mia'
+    assert capture['status'] == 200
+    assert capture['trigger'] == 'signed'
+    assert capture['duration_ms'] > 0
+    download = client.get(f"/admin/profiles/{capture['id']}", headers=ADMIN)
+    assert download.status_code == 200
+    for line in download.data.decode().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0 and stack
+
+def test_bad_or_expired_tokens_are_ignored(client, profiling):
+    client.get('/api/images?username=mia', headers={'X-Profile': '9999999999.forged'})
+    client.get('/api/images?username=mia&_profile=' + profiling.sign(int(time.time()) - 1))
+    assert profiling.list_captures() == []
+
+def test_query_flag_and_sampling(client, profiling, monkeypatch):
+    client.get('/gallery?_profile=' + profiling.sign(int(time.time()) + 60))
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1)
+    client.get('/api/categories?username=mia')
+    triggers = sorted(c['trigger'] for c in profiling.list_captures())
+    assert triggers == ['sampled', 'signed']
+
+def test_ring_buffer_is_bounded(client, profiling, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setattr(profiling, "PROFILE_MAX_CAPTURES", 3)
+    for i in range(5):
+        client.get(f'/api/images?username=user{i}')
+    users = [c['user'] for c in profiling.list_captures()]
+    assert users == ['user4', 'user3', 'user2']
+
+def test_deterministic_mode_writes_pstats(client, profiling, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setattr(profiling, "PROFILE_MODE", "deterministic")
+    client.get('/api/images?username=mia')
+    [capture] = profiling.list_captures()
+    pstats.Stats(profiling.capture_file(capture['id']))
+
+def test_admin_routes_require_token(client, profiling, monkeypatch):
+    assert client.get('/admin/profiles').status_code == 404
+    assert client.get('/admin/profiles', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    assert client.get('/admin/profiles/../../etc', headers=ADMIN).status_code == 404
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "")
+    assert client.get('/admin/profiles', headers={'Authorization': 'Bearer '}).status_code == 404
@@ -0,0 +1,216 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from moto import mock_aws
+from src.database import storageAws
+# The copy storageAws calls through (it imports web.resilience, not src.web.resilience)
+resilience = storageAws.resilience
+
+BUCKET = "test-bucket"
+
+
+class FaultInjectingClient:
+    """Moto-backed S3 client whose next calls to an operation can fail or stall"""
+
+    def __init__(self, client):
+        self._client = client
+        self.faults = {}
+        self.calls = Counter()
+
+    def inject(self, operation, *actions):
+        """Each action is an exception to raise or a number of seconds to sleep first"""
+        self.faults.setdefault(operation, []).extend(actions)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def wrapped(*args, **kwargs):
+            self.calls[name] += 1
+            pending = self.faults.get(name)
+            if pending:
+                action = pending.pop(0)
+                if isinstance(action, Exception):
+                    raise action
+                time.sleep(action)
+            return attr(*args, **kwargs)
+
+        return wrapped
+
+
+def slow_down(operation="PutObject"):
+    return ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Reduce your request rate'},
+                        'ResponseMetadata': {'HTTPStatusCode': 503}}, operation)
+
+
+@pytest.fixture
+def faulty(monkeypatch):
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        faulty = FaultInjectingClient(client)
+        monkeypatch.setattr(storageAws, "create_client", lambda: faulty)
+        monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.001)
+        monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(3, 30))
+        yield faulty
+
+
+def test_upload_retries_through_slowdown(faulty):
+    faulty.inject("put_object", slow_down(), slow_down())
+    metadata = storageAws.upload_image_with_metadata(BUCKET, BytesIO(b"payload"), "a.bin")
+    assert metadata is not None
+    assert faulty.calls["put_object"] == 3
+    body = faulty.get_object(Bucket=BUCKET, Key="a.bin")["Body"].read()
+    assert body == b"payload"
+
+
+def test_gives_up_after_max_attempts(faulty, monkeypatch):
+    monkeypatch.setattr(resilience, "MAX_ATTEMPTS", 2)
+    faulty.inject("delete_object", slow_down("DeleteObject"), slow_down("DeleteObject"))
+    assert storageAws.delete_image(BUCKET, "a.bin") is False
+    assert faulty.calls["delete_object"] == 2
+
+
+def test_client_errors_are_not_retried(faulty):
+    assert storageAws.get_image(BUCKET, "missing.png") is None
+    assert faulty.calls["get_object"] == 1
+
+
+def test_deadline_bounds_total_retry_time(faulty, monkeypatch):
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 1)
+    monkeypatch.setattr(resilience, "DEFAULT_DEADLINE", 0.05)
+    faulty.inject("list_objects_v2", *[slow_down("ListObjectsV2")] * 5)
+    start = time.monotonic()
+    assert storageAws.list_images(BUCKET) == []
+    assert time.monotonic() - start < 1
+
+
+def test_breaker_opens_and_fails_fast(faulty, monkeypatch):
+    monkeypatch.setattr(resilience, "MAX_ATTEMPTS", 1)
+    faulty.inject("delete_object", *[slow_down("DeleteObject")] * 3)
+    for _ in range(3):
+        assert storageAws.delete_image(BUCKET, "a.bin") is False
+    assert resilience.breaker.state == "open"
+    assert storageAws.delete_image(BUCKET, "a.bin") is False
+    assert faulty.calls["delete_object"] == 3
+
+
+def test_breaker_probe_closes_after_cooldown(faulty, monkeypatch):
+    monkeypatch.setattr(resilience, "MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(1, 0.05))
+    faulty.inject("delete_object", slow_down("DeleteObject"))
+    assert storageAws.delete_image(BUCKET, "a.bin") is False
+    assert resilience.breaker.state == "open"
+    time.sleep(0.06)
+    assert storageAws.delete_image(BUCKET, "a.bin") is True
+    assert resilience.breaker.state == "closed"
+
+
+def test_hedged_read_beats_slow_request(faulty, monkeypatch):
+    faulty.put_object(Bucket=BUCKET, Key="pic.png", Body=b"image bytes")
+    monkeypatch.setattr(resilience, "HEDGE_AFTER", 0.02)
+    faulty.inject("get_object", 1.0)
+    start = time.monotonic()
+    assert storageAws.get_image(BUCKET, "pic.png") == b"image bytes"
+    assert time.monotonic() - start < 0.5
+    assert faulty.calls["get_object"] == 2
+
+
+def test_transport_errors_surface_as_client_error(monkeypatch):
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(10, 30))
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise EndpointConnectionError(endpoint_url="https://s3.example")
+
+    with pytest.raises(ClientError) as info:
+        resilience.call("get_object", failing)
+    assert info.value.response['Error']['Code'] == 'ServiceUnavailable'
+    assert len(calls) == resilience.MAX_ATTEMPTS
+
+
+def test_deadline_bounds_a_single_slow_attempt(faulty, monkeypatch):
+    monkeypatch.setattr(resilience, "DEFAULT_DEADLINE", 0.05)
+    faulty.inject("list_objects_v2", 1.0)
+    start = time.monotonic()
+    assert storageAws.list_images(BUCKET) == []
+    assert time.monotonic() - start < 0.5
+
+
+def test_client_errors_do_not_close_the_breaker(monkeypatch):
+    monkeypatch.setattr(resilience, "MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(2, 0))
+
+    def raising(error):
+        def fn():
+            raise error
+        return fn
+
+    not_found = ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}},
+                            "GetObject")
+    for error in (slow_down("GetObject"), not_found, slow_down("GetObject")):
+        with pytest.raises(ClientError):
+            resilience.call("get_object", raising(error))
+    assert resilience.breaker.opened_at is not None
+    with pytest.raises(ClientError):
+        resilience.call("get_object", raising(not_found))
+    assert resilience.breaker.opened_at is not None
+
+
+def test_losing_hedge_body_is_closed(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_AFTER", 0.01)
+    bodies = [BytesIO(b"slow"), BytesIO(b"fast")]
+
+    def get():
+        body = bodies.pop(0)
+        if body.getvalue() == b"slow":
+            time.sleep(0.1)
+        return {'Body': body}
+
+    slow, fast = bodies
+    assert resilience.call("get_object", get, idempotent=True)['Body'] is fast
+    time.sleep(0.2)
+    assert slow.closed and not fast.closed
+
+
+def test_attempt_pool_works_after_fork():
+    assert resilience.call("get_object", lambda: "parent", deadline=2) == "parent"
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            result = resilience.call("get_object", lambda: "child", deadline=2)
+            os.write(write_end, result.encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    start = time.monotonic()
+    output = os.read(read_end, 16)
+    os.waitpid(pid, 0)
+    os.close(read_end)
+    assert output == b"child"
+    assert time.monotonic() - start < 1
+
+
+def test_queued_attempt_is_cancelled_at_the_deadline(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(resilience, "get_attempt_pool", lambda: pool)
+    monkeypatch.setattr(resilience, "MAX_ATTEMPTS", 1)
+    ran = []
+    pool.submit(time.sleep, 0.2)
+    with pytest.raises(ClientError):
+        resilience.call("put_object", lambda: ran.append(True), deadline=0.05)
+    pool.shutdown(wait=True)
+    assert ran == []
+
+
+def test_copies_have_their_own_deadline():
+    assert resilience.DEADLINES['copy'] == resilience.COPY_DEADLINE > resilience.DEFAULT_DEADLINE
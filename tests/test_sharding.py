@@ -0,0 +1,109 @@
+import os
+import boto3
+import pytest
+from io import BytesIO
+from moto import mock_aws
+import src.app as app_module
+from src.app import app
+from src.database import database
+from database import reshard
+
+ADMIN = {'Authorization': 'Bearer admin-token'}
+USERS = [f"user{i}" for i in range(12)]
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    # The app imports its own copy of the module, so both are pointed at the shards
+    for module in (database, app_module.database):
+        monkeypatch.setattr(module, "DB_NAME", str(tmp_path / "images.db"))
+        monkeypatch.setattr(module, "DB_SHARDS", 4)
+        monkeypatch.setattr(module, "_writers", {})
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "admin-token")
+    database.init_db()
+    app_module.database.clear_user_id_cache()
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        yield tmp_path
+
+def upload(client, username, name):
+    data = {'username': username, 'category': 'pics', 'file': (BytesIO(b'img'), name)}
+    assert client.post('/api/upload', data=data).status_code == 200
+
+def users_in(path):
+    conn = database.sqlite3.connect(path)
+    names = {row[0] for row in conn.execute("SELECT username FROM users")}
+    conn.close()
+    return names
+
+def test_shard_for_is_stable_and_in_range():
+    assert database.shard_for("alice", 8) == database.shard_for("alice", 8)
+    assert {database.shard_for(name, 4) for name in USERS} == {0, 1, 2, 3}
+    assert database.shard_for("alice", 1) == 0
+
+def test_single_shard_uses_database_path(monkeypatch):
+    monkeypatch.setattr(database, "DB_SHARDS", 1)
+    assert database.shard_path(0) == database.DB_NAME
+    assert database.shard_path(2, 4).endswith(".2-of-4.db")
+
+def test_users_live_only_in_their_shard(client, shards):
+    for username in USERS:
+        upload(client, username, 'a.png')
+        client.post('/api/categories', json={'username': username, 'category_name': 'trips'})
+    for shard in range(4):
+        assert users_in(database.shard_path(shard)) == {u for u in USERS if database.shard_for(u) == shard}
+    for username in USERS:
+        assert client.get(f'/api/images?username={username}').json == [
+            f'https://test-bucket.s3.amazonaws.com/{username}/pics/a.png']
+        assert [c['name'] for c in client.get(f'/api/categories?username={username}').json] == ['trips']
+
+def test_stats_sum_all_shards(client, shards):
+    for username in USERS[:6]:
+        upload(client, username, 'a.png')
+        upload(client, username, 'b.png')
+    client.delete('/api/images/delete', json={'username': USERS[0], 'category': 'pics', 'image_name': 'b.png'})
+    stats = client.get('/admin/stats', headers=ADMIN).json
+    assert (stats['users'], stats['images'], stats['deleted_images']) == (6, 11, 1)
+    assert [s['shard'] for s in stats['shards']] == [0, 1, 2, 3]
+    assert sum(s['users'] for s in stats['shards']) == 6
+    assert client.get('/admin/stats').status_code == 404
+
+def test_gc_collects_every_shard(client, shards):
+    for username in USERS:
+        upload(client, username, 'a.png')
+        client.delete('/api/images/delete', json={'username': username, 'category': 'pics', 'image_name': 'a.png'})
+    assert client.post('/admin/gc', headers=ADMIN).json['purged'] == 0
+    for shard in range(4):
+        conn = database.get_db_connection(shard)
+        conn.execute("UPDATE images SET deleted_at = datetime('now', '-2 days')")
+        conn.commit()
+        conn.close()
+    assert client.post('/admin/gc', headers=ADMIN).json['purged'] == len(USERS)
+
+def test_reshard_preserves_every_user(client, shards, monkeypatch):
+    for username in USERS:
+        upload(client, username, 'a.png')
+    client.delete('/api/images/delete', json={'username': USERS[1], 'category': 'pics', 'image_name': 'a.png'})
+    counts = reshard.reshard(4, 2)
+    assert sum(c['users'] for c in counts) == len(USERS)
+    assert sum(c['images'] for c in counts) == len(USERS)
+    with pytest.raises(FileExistsError):
+        reshard.reshard(4, 2)
+
+    for module in (database, app_module.database):
+        monkeypatch.setattr(module, "DB_SHARDS", 2)
+    app_module.database.clear_user_id_cache()
+    for username in USERS:
+        expected = [] if username == USERS[1] else [f'https://test-bucket.s3.amazonaws.com/{username}/pics/a.png']
+        assert client.get(f'/api/images?username={username}').json == expected
+    restore = {'username': USERS[1], 'category': 'pics', 'image_name': 'a.png'}
+    assert client.post('/api/images/restore', json=restore).status_code == 200
+    upload(client, USERS[0], 'b.png')
+    assert len(client.get(f'/api/images?username={USERS[0]}').json) == 2
+    assert os.path.exists(database.shard_path(0, 4))
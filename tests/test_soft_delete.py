@@ -0,0 +1,154 @@
+import boto3
+from io import BytesIO
+import pytest
+from moto import mock_aws
+import src.app as app_module
+from src.app import app
+from src.database import database
+
+ADMIN = {'Authorization': 'Bearer admin-token'}
+IMAGE = {'username': 'ivy', 'category': 'cats', 'image_name': 'tom.png'}
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def s3(monkeypatch):
+    database.init_db()
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "admin-token")
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(app_module, "BUCKET_NAME", "test-bucket")
+        yield s3
+
+def _upload(client, name='tom.png'):
+    response = client.post('/api/upload', data={
+        'username': 'ivy', 'category': 'cats', 'file': (BytesIO(b'img'), name)
+    })
+    assert response.status_code == 200
+
+def _expire_tombstones():
+    conn = database.get_db_connection()
+    conn.execute("UPDATE images SET deleted_at = datetime('now', '-2 days') WHERE deleted_at IS NOT NULL")
+    conn.commit()
+    conn.close()
+
+def _keys(s3):
+    return [obj['Key'] for obj in s3.list_objects_v2(Bucket="test-bucket").get('Contents', [])]
+
+def test_delete_hides_image_but_keeps_object(client, s3):
+    _upload(client)
+    assert client.delete('/api/images/delete', json=IMAGE).status_code == 200
+    assert client.get('/api/images?username=ivy').json == []
+    assert client.get('/img/ivy/cats/tom.png').status_code == 404
+    assert _keys(s3) == ['ivy/cats/tom.png']
+    assert client.delete('/api/images/delete', json=IMAGE).status_code == 404
+
+def test_restore_within_window(client, s3):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    response = client.post('/api/images/restore', json=IMAGE)
+    assert response.status_code == 200
+    assert client.get('/api/images?username=ivy').json == [response.json['url']]
+    assert client.post('/api/images/restore', json=IMAGE).status_code == 404
+
+def test_restore_rejected_after_reupload_or_expiry(client, s3):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _upload(client)
+    assert client.post('/api/images/restore', json=IMAGE).status_code == 409
+    client.delete('/api/images/delete', json=IMAGE)
+    _expire_tombstones()
+    assert client.post('/api/images/restore', json=IMAGE).status_code == 404
+
+def test_gc_deletes_expired_objects_and_rows(client, s3):
+    for name in ('a.png', 'b.png', 'keep.png'):
+        _upload(client, name)
+    for name in ('a.png', 'b.png'):
+        client.delete('/api/images/delete', json={**IMAGE, 'image_name': name})
+    assert client.post('/admin/gc', headers=ADMIN).json['purged'] == 0
+    _expire_tombstones()
+    result = client.post('/admin/gc', headers=ADMIN).json
+    assert result == {'purged': 2, 'objects_deleted': 2, 'failed': 0}
+    assert _keys(s3) == ['ivy/cats/keep.png']
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 1
+    conn.close()
+
+def test_gc_keeps_object_uploaded_again(client, s3):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _upload(client)
+    _expire_tombstones()
+    assert client.post('/admin/gc', headers=ADMIN).json['purged'] == 1
+    assert _keys(s3) == ['ivy/cats/tom.png']
+    assert len(client.get('/api/images?username=ivy').json) == 1
+
+def test_gc_keeps_object_overwritten_before_its_row_exists(client, s3):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _expire_tombstones()
+    # A re-upload has replaced the object but not yet written its row
+    s3.put_object(Bucket="test-bucket", Key="ivy/cats/tom.png", Body=b"new")
+    result = client.post('/admin/gc', headers=ADMIN).json
+    assert result == {'purged': 1, 'objects_deleted': 0, 'failed': 0}
+    assert _keys(s3) == ['ivy/cats/tom.png']
+
+def test_gc_rechecks_live_rows_before_deleting(client, s3, monkeypatch):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _expire_tombstones()
+    collector = app_module.imageCollector
+    get_expired_tombstones = collector.database.get_expired_tombstones
+
+    def reuploaded_meanwhile(*args):
+        tombstones = get_expired_tombstones(*args)
+        if tombstones:
+            _upload(client)
+        return tombstones
+
+    monkeypatch.setattr(collector.database, "get_expired_tombstones", reuploaded_meanwhile)
+    assert collector.collect()['objects_deleted'] == 0
+    assert _keys(s3) == ['ivy/cats/tom.png']
+    assert len(client.get('/api/images?username=ivy').json) == 1
+
+def test_uploads_do_not_wait_on_object_deletes(client, s3, monkeypatch):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _expire_tombstones()
+    collector = app_module.imageCollector
+    delete_locations = collector.storageAws.delete_locations
+
+    def upload_meanwhile(locations):
+        # Would fail with "database is locked" if the shard were held during S3 calls
+        _upload(client, 'jerry.png')
+        return delete_locations(locations)
+
+    monkeypatch.setattr(collector.storageAws, "delete_locations", upload_meanwhile)
+    assert collector.collect() == {'purged': 1, 'objects_deleted': 1, 'failed': 0}
+    assert _keys(s3) == ['ivy/cats/jerry.png']
+
+def test_one_collector_at_a_time(client, s3):
+    collector = app_module.imageCollector
+    with collector._exclusive(blocking=True) as held:
+        with collector._exclusive(blocking=False) as second:
+            assert held and not second
+
+def test_gc_retries_failed_deletes(client, s3, monkeypatch):
+    _upload(client)
+    client.delete('/api/images/delete', json=IMAGE)
+    _expire_tombstones()
+    collector = app_module.imageCollector
+    delete_locations = collector.storageAws.delete_locations
+    monkeypatch.setattr(collector.storageAws, "delete_locations", lambda locations: list(locations))
+    assert collector.collect() == {'purged': 0, 'objects_deleted': 0, 'failed': 1}
+    monkeypatch.setattr(collector.storageAws, "delete_locations", delete_locations)
+    assert collector.collect()['purged'] == 1
+    assert _keys(s3) == []
+
+def test_gc_requires_admin(client, s3):
+    assert client.post('/admin/gc').status_code == 404
@@ -0,0 +1,72 @@
+import gzip
+import re
+import pytest
+from src.app import app
+from src.database import database
+from src.web import staticAssets
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def reset_database():
+    database.init_db()
+    yield
+
+def script_url(client):
+    page = client.get('/gallery').data.decode()
+    return re.search(r'src="(/static/images/grid\.[0-9a-f]{12}\.js)"', page).group(1)
+
+def test_templates_link_fingerprinted_assets(client):
+    assert script_url(client)
+
+def test_fingerprinted_assets_are_immutable(client):
+    response = client.get(script_url(client))
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Content-Encoding' not in response.headers
+    assert b'renderImages' in response.data
+
+def test_precompressed_gzip_variant(client):
+    url = script_url(client)
+    plain = client.get(url).data
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain
+
+def test_precompressed_brotli_variant(client):
+    brotli = pytest.importorskip('brotli')
+    url = script_url(client)
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == client.get(url).data
+
+def test_unfingerprinted_path_still_served(client):
+    response = client.get('/static/images/grid.js')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+def test_large_json_is_compressed(client, monkeypatch):
+    monkeypatch.setattr(staticAssets, 'brotli', None)
+    for i in range(40):
+        database.add_image('lena', f'https://bucket.s3.amazonaws.com/lena/c/{i}.png')
+    response = client.get('/api/images?username=lena', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.data)) > len(response.data)
+
+def test_uncompressed_variant_also_varies(client):
+    for i in range(40):
+        database.add_image('lena', f'https://bucket.s3.amazonaws.com/lena/c/{i}.png')
+    response = client.get('/api/images?username=lena', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_small_json_is_not_compressed(client):
+    response = client.get('/api/images?username=nobody', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.json == []
@@ -2,6 +2,7 @@ import pytest
 import boto3
 from moto import mock_aws
 from io import BytesIO
+from PIL import Image
 from src.database import storageAws
 
 @pytest.fixture
@@ -91,4 +92,34 @@ def test_get_images_by_user_and_category(s3_client, bucket_name):
     s3_client.put_object(Bucket=bucket_name, Key="alice/photos/pic.jpg", Body=b"")
     images = storageAws.get_images_by_user_and_category(bucket_name, "alice", "designs")
     assert len(images) == 1
-    assert "alice/designs/logo.png" in images
\ No newline at end of file
+    assert "alice/designs/logo.png" in images
+
+def _png_bytes(width, height):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (200, 10, 10)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@mock_aws
+def test_upload_with_metadata_captures_details(s3_client, bucket_name):
+    s3_client.create_bucket(Bucket=bucket_name)
+    data = _png_bytes(40, 30)
+    metadata = storageAws.upload_image_with_metadata(bucket_name, BytesIO(data), "pic.png", "image/png")
+    head = s3_client.head_object(Bucket=bucket_name, Key="pic.png")
+    assert metadata["size_bytes"] == len(data)
+    assert metadata["content_type"] == "image/png"
+    assert metadata["etag"] == head["ETag"]
+    assert (metadata["width"], metadata["height"]) == (40, 30)
+    assert metadata["placeholder"] == "#c80a0a"
+    assert s3_client.get_object(Bucket=bucket_name, Key="pic.png")["Body"].read() == data
+
+@mock_aws
+def test_upload_with_metadata_non_image(s3_client, bucket_name):
+    s3_client.create_bucket(Bucket=bucket_name)
+    metadata = storageAws.upload_image_with_metadata(bucket_name, BytesIO(b"not an image"), "a.txt")
+    assert metadata["size_bytes"] == 12
+    assert metadata["width"] is None and metadata["height"] is None
+    assert metadata["placeholder"] is None
+
+@mock_aws
+def test_upload_with_metadata_fails_missing_bucket():
+    assert storageAws.upload_image_with_metadata("missing-bucket", BytesIO(b"x"), "a.txt") is None
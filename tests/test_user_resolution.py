@@ -0,0 +1,79 @@
+import sqlite3
+import pytest
+from src.database import database
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    database.init_db()
+    return path
+
+def _count_statements(monkeypatch):
+    statements = []
+    connect = database.get_db_connection
+
+    def traced(shard=0):
+        conn = connect(shard)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database, "get_db_connection", traced)
+    return statements
+
+def test_get_or_create_user_is_idempotent(db_path):
+    alice = database.get_or_create_user("alice")
+    database.clear_user_id_cache()
+    assert database.get_or_create_user("alice") == alice
+    assert database.get_or_create_user("bob") != alice
+    assert database.get_user_id("alice") == alice
+
+def test_cached_user_makes_add_image_one_insert(db_path, monkeypatch):
+    database.add_image("alice", "https://bucket/alice/a.png")
+    statements = _count_statements(monkeypatch)
+    database.add_image("alice", "https://bucket/alice/b.png")
+    # One insert for the image, one for its change-log entry, no user lookup
+    writes = [s.split()[:3] for s in statements if s not in ("BEGIN ", "COMMIT")]
+    assert writes == [["INSERT", "INTO", "images"], ["INSERT", "INTO", "changes"]]
+    assert len(database.get_images_by_username("alice")) == 2
+
+def test_stale_cache_entry_is_not_trusted(db_path):
+    database.add_image("alice", "https://bucket/alice/a.png")
+    # Rebuild users behind the cache's back so alice's cached id now belongs to bob
+    conn = sqlite3.connect(db_path)
+    conn.executescript("DELETE FROM users; DELETE FROM sqlite_sequence; DELETE FROM images;")
+    conn.execute("INSERT INTO users (username) VALUES ('bob')")
+    conn.commit()
+    conn.close()
+    database.add_image("alice", "https://bucket/alice/b.png")
+    assert database.get_images_by_username("bob") == []
+    assert database.get_images_by_username("alice") == ["https://bucket/alice/b.png"]
+
+def test_cache_is_bounded(db_path, monkeypatch):
+    monkeypatch.setattr(database, "USER_ID_CACHE_SIZE", 2)
+    for name in ("a", "b", "c"):
+        database.get_or_create_user(name)
+    assert list(database._user_ids) == ["b", "c"]
+
+def test_create_category_reports_existing(db_path):
+    created = database.create_category_for_user("alice", "cats")
+    again = database.create_category_for_user("alice", "cats")
+    assert created['success'] and not again['success']
+    assert again['category_id'] == created['category_id'] == database.category_exists("alice", "cats")
+    assert database.category_exists("bob", "cats") is None
+
+def test_rolled_back_user_is_not_cached(db_path, monkeypatch):
+    monkeypatch.setattr(database, "GROUP_COMMIT", True)
+    monkeypatch.setattr(database, "_writers", {})
+
+    def create_then_fail(conn):
+        database._resolve_user(conn, "ghost")
+        raise ValueError("rolled back")
+
+    with pytest.raises(ValueError):
+        database.run_write(0, create_then_fail)
+    assert database._cached_user_id("ghost") is None
+    # The rolled-back id is reused by the next user, and must not be mistaken for ghost's
+    carol = database.get_or_create_user("carol")
+    assert database.get_or_create_user("ghost") != carol
+    database.get_writer(0).close()